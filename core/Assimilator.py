@@ -8,7 +8,12 @@ import pickle
 from datetime import date,datetime,timedelta
 from GC_Translator import GC_Translator
 from HIST_Ens import HIST_Ens
+from ensemble_cube import EnsembleCube,getEnsembleCubePath
+from column_store import ColumnWriter,getColumnContainerPrefix
 from os.path import isfile
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor
 
 
 #Contains a dictionary referencing GC_Translators for every run directory.
@@ -20,7 +25,7 @@ from os.path import isfile
 #That restart will be overwritten in place (name not changed) so next run starts from the assimilation state vector.
 #Emissions scaling factors are most recent available (one assimilation timestep ago). New values will be appended to netCDF. 
 class Assimilator(object):
-	def __init__(self,timestamp,ensnum,corenum,timestamp_from_rip=None):
+	def __init__(self,timestamp,ensnum,corenum,timestamp_from_rip=None,useEnsembleCube=False):
 		spc_config = si.getSpeciesConfig()
 		self.verbose = int(spc_config['verbose'])
 		self.ensnum = ensnum
@@ -32,7 +37,9 @@ class Assimilator(object):
 		path_to_ensemble = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/ensemble_runs"
 		self.path_to_scratch = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch"
 		self.path_to_logs = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/ensemble_runs/logs"
+		self.timestamp = timestamp
 		self.parfilename = f'ens_{ensnum}_core_{corenum}_time_{timestamp}'
+		self.ncore = int(spc_config['MaxPar'])
 		subdirs = glob(f"{path_to_ensemble}/*/")
 		subdirs.remove(f"{path_to_ensemble}/logs/")
 		dirnames = [d.split('/')[-2] for d in subdirs]
@@ -61,6 +68,14 @@ class Assimilator(object):
 		self.AverageScaleFactorPosteriorWithPrior = spc_config["AverageScaleFactorPosteriorWithPrior"] == "True"
 		self.RTPS = spc_config["Activate_Relaxation_To_Prior_Spread"] == "True"
 		self.RTPS_parameter = float(spc_config["RTPS_parameter"])
+		self.BatchLETKF = spc_config["BATCH_LETKF"] == "True"
+		self.BatchLETKFSize = int(spc_config["BATCH_LETKF_SIZE"]) #Maximum number of columns solved together
+		self.WeightKernel = spc_config["LETKF_WEIGHT_KERNEL"]
+		if self.WeightKernel not in ['eigh','sqrtm']:
+			raise ValueError(f"LETKF weight kernel '{self.WeightKernel}' not recognized.")
+		self.DenseR = spc_config["USE_DENSE_OBS_ERROR_COVARIANCE"] == "True"
+		if self.BatchLETKF and self.DenseR:
+			raise ValueError("Batched LETKF requires a diagonal observational error covariance; set USE_DENSE_OBS_ERROR_COVARIANCE to False or BATCH_LETKF to False.")
 		self.SaveLevelEdgeDiags = spc_config["SaveLevelEdgeDiags"] == "True"
 		self.lognormalErrors = spc_config["lognormalErrors"] == "True"
 		self.SaveStateMet = spc_config["SaveStateMet"] == "True"
@@ -73,6 +88,7 @@ class Assimilator(object):
 		self.PriorWeightinPriorPosteriorAverage = float(spc_config["PriorWeightinPriorPosteriorAverage"])
 		self.PriorWeightinSFAverage = float(spc_config["PriorWeightinSFAverage"])
 		self.gt = {}
+		self.backgroundIsColumn = False #True when background ensemble only holds the column being assimilated, rather than the localized patch.
 		self.observed_species = spc_config['OBSERVED_SPECIES']
 		self.assimilate_observation = spc_config['ASSIMILATE_OBS']
 		for ao in self.assimilate_observation:
@@ -84,12 +100,26 @@ class Assimilator(object):
 			timestamp_for_gt = timestamp_from_rip
 		else:
 			timestamp_for_gt = timestamp
-		for ens, directory in zip(subdir_numbers,subdirs):
-			if ens==0:
-				self.control = GC_Translator(directory, timestamp_for_gt, False,self.verbose)
-			else: 
-				self.gt[ens] = GC_Translator(directory, timestamp_for_gt, True,self.verbose)
-				ensemble_numbers.append(ens)
+		self.ensembleCube = None
+		if useEnsembleCube:
+			#Attach to the shared ensemble cube (built once per window by whichever worker gets there first). Only the first 
+			#member is loaded here, for grid information and state vector indexing; the control is not needed for the LETKF.
+			directories = {}
+			for ens, directory in zip(subdir_numbers,subdirs):
+				if ens!=0:
+					directories[ens] = directory
+					ensemble_numbers.append(ens)
+			self.ensembleCube = EnsembleCube(getEnsembleCubePath(spc_config),timestamp,self.verbose)
+			self.ensembleCube.buildOrAttach(directories,timestamp_for_gt,f'{self.path_to_scratch}/KILL_ENS')
+			firstens = min(ensemble_numbers)
+			self.gt[firstens] = GC_Translator(directories[firstens], timestamp_for_gt, True,self.verbose)
+		else:
+			for ens, directory in zip(subdir_numbers,subdirs):
+				if ens==0:
+					self.control = GC_Translator(directory, timestamp_for_gt, False,self.verbose)
+				else: 
+					self.gt[ens] = GC_Translator(directory, timestamp_for_gt, True,self.verbose)
+					ensemble_numbers.append(ens)
 		self.ensemble_numbers=np.array(ensemble_numbers)
 		if self.verbose>=2:
 			print(f"GC Translators created. Ensemble number list: {self.ensemble_numbers}")
@@ -131,23 +161,40 @@ class Assimilator(object):
 		return self.gt[1].getLon()
 	def getLev(self):
 		return self.gt[1].getLev()
-	def combineEnsemble(self,latind=None,lonind=None):
+	#If columnOnly is True, only return the entries of the state vector for the column at latind,lonind (not the localized patch).
+	def combineEnsemble(self,latind=None,lonind=None,columnOnly=False):
 		if self.verbose>=2:
 			print(f'combineEnsemble called in Assimilator for lat/lon inds {(latind,lonind)}')
 		firstens = self.ensemble_numbers[0]
-		firstvec = self.gt[firstens].getStateVector(latind,lonind)
+		if self.ensembleCube is not None: #Gather directly from the shared ensemble cube
+			if columnOnly:
+				inds = self.gt[firstens].getColumnIndicesFromFullStateVector(latind,lonind)
+			else:
+				inds = self.gt[firstens].getLocalizedStateVectorIndices(latind,lonind)
+			statevecs = self.ensembleCube.getStateVectors(inds)
+			if self.verbose>=2:
+				print(f'Ensemble combined from ensemble cube in Assimilator for lat/lon inds {(latind,lonind)} and has dimensions {np.shape(statevecs)}.')
+			return statevecs
+		if columnOnly:
+			colinds = self.gt[firstens].getColumnIndicesFromFullStateVector(latind,lonind) #Same for every ensemble member
+			firstvec = self.gt[firstens].getStateVector()[colinds]
+		else:
+			firstvec = self.gt[firstens].getStateVector(latind,lonind)
 		statevecs = np.zeros((len(firstvec),len(self.ensemble_numbers)))
 		statevecs[:,firstens-1] = firstvec
 		for i in self.ensemble_numbers:
 			if i!=firstens:
-				statevecs[:,i-1] = self.gt[i].getStateVector(latind,lonind)
+				if columnOnly:
+					statevecs[:,i-1] = self.gt[i].getStateVector()[colinds]
+				else:
+					statevecs[:,i-1] = self.gt[i].getStateVector(latind,lonind)
 		if self.verbose>=2:
 			print(f'Ensemble combined in Assimilator for lat/lon inds {(latind,lonind)} and has dimensions {np.shape(statevecs)}.')
 		return statevecs
-	def ensMeanAndPert(self,latval,lonval):
+	def ensMeanAndPert(self,latval,lonval,columnOnly=False):
 		if self.verbose>=2:
 			print(f'ensMeanAndPert called in Assimilator for lat/lon inds {(latval,lonval)}')
-		statevecs = self.combineEnsemble(latval,lonval)
+		statevecs = self.combineEnsemble(latval,lonval,columnOnly)
 		state_mean = np.mean(statevecs,axis = 1) #calculate ensemble mean
 		bigX = np.zeros(np.shape(statevecs))
 		for i in range(np.shape(bigX)[1]):
@@ -171,11 +218,14 @@ class Assimilator(object):
 			if i!=firstens:
 				conc4D[i-1,:,:,:] = self.gt[i].getSpecies3Dconc(species)
 		return conc4D
-	def prepareMeansAndPerts(self,latval,lonval):
+	#The observation-space quantities are always localized. The LETKF only keeps the update for the column being assimilated,
+	#so it passes columnOnly=True to restrict the state-space background to that column before any analysis is calculated.
+	def prepareMeansAndPerts(self,latval,lonval,columnOnly=False):
 		if self.verbose>=2:
 			print(f'prepareMeansAndPerts called in Assimilator for lat/lon inds {(latval,lonval)}')
 		self.ybar_background, self.Ypert_background, self.ydiff = self.histens.getLocObsMeanPertDiff(latval,lonval)
-		self.xbar_background, self.Xpert_background = self.ensMeanAndPert(latval,lonval)
+		self.xbar_background, self.Xpert_background = self.ensMeanAndPert(latval,lonval,columnOnly)
+		self.backgroundIsColumn = columnOnly
 		if self.verbose>=2:
 			print(f'ybar_background for lat/lon inds {(latval,lonval)} has shape {np.shape(self.ybar_background)}.')
 			print(f'Ypert_background for lat/lon inds {(latval,lonval)} has shape {np.shape(self.Ypert_background)}.')
@@ -185,11 +235,17 @@ class Assimilator(object):
 	def makeR(self,latind=None,lonind=None):
 		if self.verbose>=2:
 			print(f"Making R for lat/lon inds {(latind,lonind)}.")
-		self.R = self.histens.makeR(latind,lonind)
+		if self.DenseR:
+			self.R = self.histens.makeR(latind,lonind)
+		else:
+			self.R = self.histens.makeRVector(latind,lonind) #Vector of variances along the diagonal of R
 		if self.verbose>=2:
 			print(f'R for {(latind,lonind)} has dimension {np.shape(self.R)} and value {self.R}')
 	def makeC(self):
-		self.C = np.transpose(self.Ypert_background) @ la.inv(self.R)
+		if np.ndim(self.R)==1: #Diagonal R stored as a vector, so inverting is elementwise
+			self.C = np.transpose(self.Ypert_background)*(1/self.R)
+		else:
+			self.C = np.transpose(self.Ypert_background) @ la.inv(self.R)
 		if self.verbose>=3:
 			print(f'C made in Assimilator. It has dimension {np.shape(self.C)} and value {self.C}')
 	def makePtildeAnalysis(self):
@@ -204,6 +260,29 @@ class Assimilator(object):
 		self.WAnalysis = la.sqrtm((k-1)*self.PtildeAnalysis)
 		if self.verbose>=3:
 			print(f'WAnalysis initialized in Assimilator. It has dimension {np.shape(self.WAnalysis)} and value {self.WAnalysis}')
+	#(k-1)I/(1+inflation)+CY is symmetric positive definite, so one eigendecomposition gives both Ptilde (its inverse)
+	#and WAnalysis (the symmetric square root of (k-1)*Ptilde). Works on a single k x k matrix or a stack of them.
+	def eighPtildeAndW(self,PtildeInv):
+		k = len(self.ensemble_numbers)
+		evals,evecs = np.linalg.eigh(PtildeInv)
+		evecsT = np.swapaxes(evecs,-1,-2)
+		PtildeAnalysis = (evecs/evals[...,np.newaxis,:])@evecsT
+		WAnalysis = (evecs*np.sqrt((k-1)/evals)[...,np.newaxis,:])@evecsT
+		return [PtildeAnalysis,WAnalysis]
+	def makePtildeAndWAnalysisEigh(self):
+		cyb = self.C @ self.Ypert_background
+		k = len(self.ensemble_numbers)
+		iden = (k-1)*np.identity(k)/(1+self.inflation)
+		self.PtildeAnalysis,self.WAnalysis = self.eighPtildeAndW(iden+cyb)
+		if self.verbose>=3:
+			print(f'PtildeAnalysis and WAnalysis made in Assimilator from a shared eigendecomposition. They have dimension {np.shape(self.WAnalysis)} and values {self.PtildeAnalysis} and {self.WAnalysis}')
+	#Use the analysis weight kernel selected by the user; eigh is equivalent to inv followed by sqrtm, but much cheaper.
+	def makePtildeAndWAnalysis(self):
+		if self.WeightKernel == 'eigh':
+			self.makePtildeAndWAnalysisEigh()
+		else:
+			self.makePtildeAnalysis()
+			self.makeWAnalysis()
 	def makeWbarAnalysis(self):
 		self.WbarAnalysis = self.PtildeAnalysis@self.C@self.ydiff
 		if self.verbose>=3:
@@ -215,20 +294,15 @@ class Assimilator(object):
 		if self.verbose>=3:
 			print(f'WAnalysis adjusted in Assimilator. It has dimension {np.shape(self.WAnalysis)} and value {self.WAnalysis}')
 	def makeAnalysisCombinedEnsemble(self):
-		self.analysisEnsemble = np.zeros(np.shape(self.Xpert_background))
-		k = len(self.ensemble_numbers)
-		if np.isnan(self.DOFS_filter):
-			for i in range(k):
-				self.analysisEnsemble[:,i] = self.Xpert_background.dot(self.WAnalysis[:,i])+self.xbar_background
-		else:
-			self.analysisPertEnsemble = np.zeros(np.shape(self.Xpert_background))
-			for i in range(k):
-				self.analysisPertEnsemble[:,i] = self.Xpert_background.dot(self.WAnalysis[:,i])
-				self.analysisEnsemble[:,i] = self.analysisPertEnsemble[:,i]+self.xbar_background
+		self.analysisPertEnsemble = self.Xpert_background@self.WAnalysis
+		self.analysisEnsemble = self.analysisPertEnsemble+self.xbar_background[:,np.newaxis]
 		if self.verbose>=2:
 			print(f'analysisEnsemble made in Assimilator. It has dimension {np.shape(self.analysisEnsemble)} and value {self.analysisEnsemble}')
 	def getAnalysisAndBackgroundColumn(self,latval,lonval,doBackground=True, doPerts=False):
-		colinds = self.gt[1].getColumnIndicesFromLocalizedStateVector(latval,lonval)
+		if self.backgroundIsColumn: #Background already restricted to the column
+			colinds = np.arange(len(self.xbar_background))
+		else:
+			colinds = self.gt[1].getColumnIndicesFromLocalizedStateVector(latval,lonval)
 		analysisSubset = self.analysisEnsemble[colinds,:]
 		if doPerts:
 			analysisPertSubset = self.analysisPertEnsemble[colinds,:]
@@ -247,7 +321,19 @@ class Assimilator(object):
 				return [analysisSubset,backgroundSubset]
 		else:
 			return analysisSubset
+	#DOFS per eqn 11.91 in Brasseur and Jacob is n-tr(Posterior @ Prior^-1), calculated here in ensemble space.
+	#With the thin SVD backgroundPert = U S V^T (rank r), pinv(prior) = (k-1) U S^-2 U^T, so the trace reduces to
+	#||S^-1 U^T analysisPert||_F^2, an r x k calculation. Never forms the n x n covariances; matches calculateDOFSStateSpace.
 	def calculateDOFS(self, analysisPert,backgroundPert):
+		U,S,_ = np.linalg.svd(backgroundPert,full_matrices=False)
+		rank = np.sum(S**2 > 1e-15*np.max(S)**2) #Same cutoff as np.linalg.pinv applied to the prior covariance
+		projected = (np.transpose(U[:,0:rank])@analysisPert)/S[0:rank,np.newaxis]
+		traceval = np.sum(projected**2)
+		n_elements = np.shape(analysisPert)[0]
+		dofs = n_elements-traceval
+		return dofs
+	#Original state space DOFS calculation, kept for reference and testing.
+	def calculateDOFSStateSpace(self, analysisPert,backgroundPert):
 		k = len(self.ensemble_numbers)
 		prior_err_cov = (1/(k-1))*backgroundPert@np.transpose(backgroundPert)
 		#I checked the math and eqn 13 and eqn 23 in Hunt et al are equivalent bc P tilde is symmetric
@@ -407,8 +493,9 @@ class Assimilator(object):
 					print(f'After RTPS adjustment, analysis values (with nonzero spread) have the following mean: {np.mean(analysisSubset[inds_with_spread,:],axis=1)}')
 					print(f'After RTPS adjustment, analysis values (with nonzero spread) have the following st. dev.: {np.std(analysisSubset[inds_with_spread,:],axis=1)}')
 		return analysisSubset
+	#Append the column to this core's column container, which is opened and closed by LETKF.
 	def saveColumn(self,latval,lonval,analysisSubset):
-		np.save(f'{self.path_to_scratch}/{str(self.ensnum).zfill(3)}/{str(self.corenum).zfill(3)}/{self.parfilename}_lat_{latval}_lon_{lonval}.npy',analysisSubset)
+		self.columnWriter.write(latval,lonval,analysisSubset)
 	#Simple scaling of restart concentrations to match observed values
 	def scaleRestarts(self):
 		if self.verbose>=1:
@@ -493,47 +580,189 @@ class Assimilator(object):
 		f = open(self.bigy_filename,"wb")
 		pickle.dump(bigy,f)
 		f.close()
-	def LETKF(self):
+	#Solve the k x k analysis problems for a stack of columns at once. Inputs are zero-padded to a common
+	#number of observations: Ypert_stack is (ncol,pmax,k), ydiff_stack and rinv_stack are (ncol,pmax).
+	#Padded rows have zero inverse variance, so they contribute nothing to C@Y or C@ydiff.
+	#Returns the adjusted analysis weights (ncol,k,k), equivalent to WAnalysis after adjWAnalysis for each column.
+	def makeBatchedAnalysisWeights(self,Ypert_stack,ydiff_stack,rinv_stack):
+		k = len(self.ensemble_numbers)
+		CT_stack = Ypert_stack*rinv_stack[:,:,np.newaxis] #C transpose, (ncol,pmax,k)
+		cyb = np.matmul(np.transpose(CT_stack,(0,2,1)),Ypert_stack)
+		cyd = np.einsum('cpk,cp->ck',CT_stack,ydiff_stack)
+		iden = (k-1)*np.identity(k)/(1+self.inflation)
+		PtildeAnalysis,WAnalysis = self.eighPtildeAndW(iden[np.newaxis,:,:]+cyb)
+		WbarAnalysis = np.einsum('ckl,cl->ck',PtildeAnalysis,cyd)
+		WAnalysis += WbarAnalysis[:,:,np.newaxis]
+		if self.verbose>=3:
+			print(f'Batched WAnalysis made in Assimilator. It has dimension {np.shape(WAnalysis)}.')
+		return WAnalysis
+	#Batched version of the LETKF loop. Columns are gathered in batches of at most BATCH_LETKF_SIZE, each batch is solved together,
+	#and then its columns are corrected and saved one by one. Batching bounds memory, since observations are padded to the largest count in the batch.
+	def batchLETKF(self):
 		if self.verbose>=2:
-			print(f"LETKF called! Beginning loop.")
-		if self.SaveDOFS:
-			latlen = len(self.gt[1].getLat())
-			lonlen = len(self.gt[1].getLon())
-			dofsmat = np.nan*np.zeros((latlen,lonlen))
+			print(f"Batched LETKF called! Gathering columns in batches of up to {self.BatchLETKFSize}.")
+		dofs_by_column = {}
+		batch = []
 		for latval,lonval in zip(self.latinds,self.loninds):
 			if self.verbose>=1:
-				print(f"Beginning LETKF loop for lat/lon inds {(latval,lonval)}.")
-			self.prepareMeansAndPerts(latval,lonval)
+				print(f"Gathering lat/lon inds {(latval,lonval)} for batched LETKF.")
+			self.prepareMeansAndPerts(latval,lonval,columnOnly=True)
 			if len(self.ybar_background)<self.MINNUMOBS:
 				#If we don't have enough observations, set posterior equal to prior
 				if self.verbose>=2:
 					print(f"Fewer than {self.MINNUMOBS} observations for {(latval,lonval)}; setting posterior equal to prior.")
 				analysisSubset = self.setPosteriorEqualToPrior(latval,lonval,returnSubset=True)
-				if self.SaveDOFS:
-					dofs = -1
+				self.saveColumn(latval,lonval,analysisSubset)
+				dofs_by_column[(latval,lonval)] = -1
 			else:
 				self.makeR(latval,lonval)
-				self.makeC()
-				self.makePtildeAnalysis()
-				self.makeWAnalysis()
-				self.makeWbarAnalysis()
-				self.adjWAnalysis()
-				self.makeAnalysisCombinedEnsemble()
-				if np.isnan(self.DOFS_filter):
-					analysisSubset,backgroundSubset = self.getAnalysisAndBackgroundColumn(latval,lonval,doBackground=True,doPerts=False)
-					analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval)
-				else:
-					analysisSubset,backgroundSubset,analysisPertSubset,backgroundPertSubset = self.getAnalysisAndBackgroundColumn(latval,lonval,doBackground=True,doPerts=True)
-					dofs = self.calculateDOFS(analysisPertSubset,backgroundPertSubset)
-					if dofs >= self.DOFS_filter: #DOFS high enough, proceed with corrections and overwrite
-						analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval) 
-					else: #DOFS too low, not enough information to optimize
-						analysisSubset=backgroundSubset #set analysis equal to background
+				batch.append((latval,lonval,self.Ypert_background,self.ydiff,1/self.R,self.Xpert_background,self.xbar_background)) #R is a vector of variances in batched mode
+				if len(batch)==self.BatchLETKFSize:
+					self.solveLETKFBatch(batch,dofs_by_column)
+					batch = []
+		if len(batch)>0:
+			self.solveLETKFBatch(batch,dofs_by_column)
+		return dofs_by_column
+	#Solve one batch of gathered columns, each a tuple of (latval,lonval,Ypert,ydiff,rinv,Xpert,xbar), and save the analysis columns.
+	#DOFS are recorded in dofs_by_column if a DOFS filter is in use.
+	def solveLETKFBatch(self,batch,dofs_by_column):
+		k = len(self.ensemble_numbers)
+		ncol = len(batch)
+		pmax = np.max([len(column[3]) for column in batch])
+		Ypert_stack = np.zeros((ncol,pmax,k))
+		ydiff_stack = np.zeros((ncol,pmax))
+		rinv_stack = np.zeros((ncol,pmax))
+		for i,(latval,lonval,Ypert,ydiff,rinv,Xpert,xbar) in enumerate(batch):
+			p = len(ydiff)
+			Ypert_stack[i,0:p,:] = Ypert
+			ydiff_stack[i,0:p] = ydiff
+			rinv_stack[i,0:p] = rinv
+		if self.verbose>=2:
+			print(f"Solving {ncol} columns in one batch with up to {pmax} observations each.")
+		WAnalysis_stack = self.makeBatchedAnalysisWeights(Ypert_stack,ydiff_stack,rinv_stack)
+		for i,(latval,lonval,Ypert,ydiff,rinv,backgroundPertSubset,xbar) in enumerate(batch):
+			analysisPertSubset = backgroundPertSubset@WAnalysis_stack[i]
+			analysisSubset = analysisPertSubset+xbar[:,np.newaxis]
+			backgroundSubset = backgroundPertSubset+xbar[:,np.newaxis]
+			if np.isnan(self.DOFS_filter):
+				analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval)
+			else:
+				dofs = self.calculateDOFS(analysisPertSubset,backgroundPertSubset)
+				if dofs >= self.DOFS_filter: #DOFS high enough, proceed with corrections and overwrite
+					analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval) 
+				else: #DOFS too low, not enough information to optimize
+					analysisSubset=backgroundSubset #set analysis equal to background
+				dofs_by_column[(latval,lonval)] = dofs
 			self.saveColumn(latval,lonval,analysisSubset)
-			if self.SaveDOFS:
-				dofsmat[latval,lonval] = dofs
-		#Loop is complete. If applicable, save final items.
+	#State vectors are built when the translators are created, so the LETKF no longer needs the restart and scaling factor files.
+	#Close them so that the combine step can write to them while LETKF processes are still running.
+	def closeTranslatorFiles(self):
+		for i in self.gt:
+			self.gt[i].closeFiles()
+		if self.control is not None:
+			self.control.closeFiles()
+	#Run the LETKF for this core's columns. If a ColumnQueue is passed, instead keep claiming chunks of columns from the shared queue
+	#(this core's own chunks first, then other cores' leftovers) until none remain.
+	def LETKF(self,columnQueue=None):
+		if self.verbose>=2:
+			print(f"LETKF called! Beginning loop.")
+		self.closeTranslatorFiles()
+		if self.SaveDOFS:
+			latlen = len(self.gt[1].getLat())
+			lonlen = len(self.gt[1].getLon())
+			dofsmat = np.nan*np.zeros((latlen,lonlen))
+		else:
+			dofsmat = None
+		self.columnWriter = ColumnWriter(getColumnContainerPrefix(self.path_to_scratch,self.ensnum,self.corenum,self.parfilename))
+		if columnQueue is None:
+			self.assimilateColumns(dofsmat)
+		else:
+			for latinds,loninds in columnQueue.claimChunks(self.ensnum,self.corenum):
+				self.latinds,self.loninds = latinds,loninds
+				self.assimilateColumns(dofsmat)
+		#Loop is complete. If applicable, save final items before closing the column container: the (possibly streaming)
+		#combine step moves on as soon as every container is closed, and then collects and deletes the DOFS grids.
 		if self.bigYpostprocess:
 			self.saveBigY()
 		if self.SaveDOFS:
-			np.save(f'{self.path_to_logs}/dofs_scratch/{self.parfilename}_dofsgrid.npy',dofsmat)
\ No newline at end of file
+			np.save(f'{self.path_to_logs}/dofs_scratch/{self.parfilename}_dofsgrid.npy',dofsmat)
+		self.columnWriter.close() #Container is only visible to the combine step once closed.
+	#Assimilate the columns in self.latinds and self.loninds, saving each one. If saving DOFS, fill them in to dofsmat.
+	def assimilateColumns(self,dofsmat=None):
+		if self.BatchLETKF:
+			dofs_by_column = self.batchLETKF()
+			if self.SaveDOFS:
+				for (latval,lonval),dofs in dofs_by_column.items():
+					dofsmat[latval,lonval] = dofs
+		else:
+			for latval,lonval in zip(self.latinds,self.loninds):
+				if self.verbose>=1:
+					print(f"Beginning LETKF loop for lat/lon inds {(latval,lonval)}.")
+				self.prepareMeansAndPerts(latval,lonval,columnOnly=True)
+				if len(self.ybar_background)<self.MINNUMOBS:
+					#If we don't have enough observations, set posterior equal to prior
+					if self.verbose>=2:
+						print(f"Fewer than {self.MINNUMOBS} observations for {(latval,lonval)}; setting posterior equal to prior.")
+					analysisSubset = self.setPosteriorEqualToPrior(latval,lonval,returnSubset=True)
+					if self.SaveDOFS:
+						dofs = -1
+				else:
+					self.makeR(latval,lonval)
+					self.makeC()
+					self.makePtildeAndWAnalysis()
+					self.makeWbarAnalysis()
+					self.adjWAnalysis()
+					self.makeAnalysisCombinedEnsemble()
+					if np.isnan(self.DOFS_filter):
+						analysisSubset,backgroundSubset = self.getAnalysisAndBackgroundColumn(latval,lonval,doBackground=True,doPerts=False)
+						analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval)
+					else:
+						analysisSubset,backgroundSubset,analysisPertSubset,backgroundPertSubset = self.getAnalysisAndBackgroundColumn(latval,lonval,doBackground=True,doPerts=True)
+						dofs = self.calculateDOFS(analysisPertSubset,backgroundPertSubset)
+						if dofs >= self.DOFS_filter: #DOFS high enough, proceed with corrections and overwrite
+							analysisSubset = self.applyAnalysisCorrections(analysisSubset,backgroundSubset,latval,lonval) 
+						else: #DOFS too low, not enough information to optimize
+							analysisSubset=backgroundSubset #set analysis equal to background
+				self.saveColumn(latval,lonval,analysisSubset)
+				if self.SaveDOFS:
+					dofsmat[latval,lonval] = dofs
+	#Copy of this Assimilator that handles the columns assigned to another core of the same ensemble member. 
+	#Shares the (read-only) ensemble and BigY, but has its own per-column working state.
+	def copyForCore(self,corenum):
+		assim = copy.copy(self)
+		assim.histens = copy.copy(self.histens)
+		assim.corenum = corenum
+		assim.latinds,assim.loninds = si.getLatLonList(self.ensnum,corenum)
+		assim.parfilename = f'ens_{self.ensnum}_core_{corenum}_time_{self.timestamp}'
+		return assim
+	#Run the LETKF for the columns of every core of this ensemble member from this one Assimilator, rather than one process per core.
+	#Each core's columns are a task for a pool of nworkers processes (forked, so the ensemble is shared copy-on-write) or threads.
+	#If a ColumnQueue is passed, each task claims chunks from the shared queue as in LETKF.
+	def poolLETKF(self,nworkers,pooltype='process',columnQueue=None):
+		if self.verbose>=1:
+			print(f"Pooled LETKF called with {nworkers} {pooltype} workers for {self.ncore} cores of columns.")
+		bigYpostprocess = self.bigYpostprocess
+		self.bigYpostprocess = False #Workers must not modify the shared BigY; save it once when all workers are done.
+		corenums = list(range(1,self.ncore+1))
+		self.closeTranslatorFiles() #Close before forking, so workers do not inherit the open handles
+		if pooltype == 'process':
+			global _pool_assimilator,_pool_column_queue
+			_pool_assimilator = self
+			_pool_column_queue = columnQueue
+			with ProcessPoolExecutor(max_workers=nworkers,mp_context=multiprocessing.get_context('fork')) as executor:
+				list(executor.map(_poolLETKFForCore,corenums)) #list() raises any exception from the workers
+		elif pooltype == 'thread':
+			with ThreadPoolExecutor(max_workers=nworkers) as executor:
+				list(executor.map(lambda corenum: self.copyForCore(corenum).LETKF(columnQueue),corenums))
+		else:
+			raise ValueError(f"LETKF pool type '{pooltype}' not recognized.")
+		self.bigYpostprocess = bigYpostprocess
+		if self.bigYpostprocess:
+			self.saveBigY()
+
+#Assimilator and column queue shared with forked pool workers; set by poolLETKF before the pool starts.
+_pool_assimilator = None
+_pool_column_queue = None
+
+def _poolLETKFForCore(corenum):
+	_pool_assimilator.copyForCore(corenum).LETKF(_pool_column_queue)
@@ -1,9 +1,30 @@
 import numpy as np
 import xarray as xr
+import netCDF4
 from glob import glob
 import toolbox as tx 
 import settings_interface as si 
+import localization_tools as lt
 from datetime import date,datetime,timedelta
+import pathlib
+
+#Meteorological parameters needed to build each state vector representation, and the restart variables behind each parameter code.
+PARAMS_NEEDED = {"3D":[], "surface":[], "column_sum":["temp","pres","height"], "trop_sum":["temp","pres","height","trop"]}
+MET_VARIABLES = {"temp":["Met_TMPU1"], "pres":["Met_PS1DRY","hyam","hybm"], "height":["Met_BXHEIGHT"], "trop":["Met_TropLev"]}
+
+#Restart variables read into memory when a DataBundle is created: every species CHEEREIO may read or update (state vector, amplified,
+#RTPS-inflated, observed and rescaled, or extrapolated species) and the met fields for the state vector representation.
+#Everything else in the restart (hundreds of species for fullchem) stays on disk and is copied through unchanged when the restart is saved.
+def getRestartVariablesToLoad(species_config):
+	species = set(species_config['STATE_VECTOR_CONC'])
+	species.update(species_config['species_to_amplify_not_in_statevec'])
+	species.update(species_config['species_not_in_statevec_to_RTPS'])
+	species.update(species_config['OBSERVED_SPECIES'].values())
+	species.update(species_config['species_to_approximate_for_rerun'])
+	variables = [f'SpeciesRst_{spec}' for spec in sorted(species)]
+	for code in PARAMS_NEEDED.get(species_config['STATE_VECTOR_CONC_REPRESENTATION'],[]):
+		variables.extend(MET_VARIABLES[code])
+	return variables
 
 #This class contains useful methods for getting data from GEOS-Chem restart files and 
 #emissions scaling factor netCDFs. After initialization it contains the necessary data
@@ -63,12 +84,16 @@ class GC_Translator(object):
 		return self.data.getEmisLon(species)
 	def addEmisSF(self, species, emis2d): #Add 2d emissions scaling factors to the end of the emissions scaling factor
 		self.data.addEmisSF(species, emis2d)
+	def closeFiles(self):
+		self.data.closeFiles()
 	######    END FUNCTIONS THAT ALIAS DATA BUNDLE    ########
 	######    BEGIN FUNCTIONS THAT ALIAS STATEVECTOR    ########
 	def getLocalizedStateVectorIndices(self,latind,lonind):
 		return self.statevec.localizeFromFull(latind,lonind,True)
 	def getColumnIndicesFromFullStateVector(self,latind,lonind):
 		return self.statevec.localizeFromFull(latind,lonind,False)
+	def getColumnIndicesForCells(self,latinds,loninds):
+		return self.statevec.getColumnIndicesForCells(latinds,loninds)
 	def getColumnIndicesFromLocalizedStateVector(self,latind,lonind):
 		return self.statevec.localizeFromFull(latind,lonind,'intersect')
 	def getStateVector(self,latind=None,lonind=None):
@@ -132,22 +157,71 @@ class GC_Translator(object):
 			analysis_emis_2d = np.reshape(analysis_subset,emis_shape) #Unflattens with 'C' order in python
 			self.addEmisSF(spec_emis,analysis_emis_2d)
 			counter+=1
+	#Overwrite only the time and the modified variables in the existing restart, so unchanged species are never decoded or re-encoded.
+	#Modified values are cast to the dtype already in the file. Falls back to rewriting the whole restart if a modified variable is not
+	#already in the file with the same shape.
 	def saveRestart(self):
-		self.data.restart_ds["time"] = (["time"], np.array([0]), {"long_name": "Time", "calendar": "gregorian", "axis":"T", "units":self.timestring})
-		self.data.restart_ds.to_netcdf(self.filename)
+		time_attrs = {"long_name": "Time", "calendar": "gregorian", "axis":"T", "units":self.timestring}
+		self.data.restart_ds["time"] = (["time"], np.array([0]), time_attrs)
+		self.data.restart_ds.close() #Release xarray's read-only handle before opening the restart for writing
+		with netCDF4.Dataset(self.filename,'a') as nc:
+			in_place = np.all([(var in nc.variables) and (nc[var].shape == self.data.restart_ds[var].shape) for var in self.data.modified_variables])
+			if in_place:
+				nc['time'][:] = 0
+				nc['time'].setncatts(time_attrs)
+				for var in self.data.modified_variables:
+					nc[var][:] = self.data.restart_ds[var].values
+				if self.verbose>=3:
+					print(f"GC_Translator number {self.num} overwrote {sorted(self.data.modified_variables)} in {self.filename}.")
+		if not in_place:
+			self.rewriteRestart()
+		self.data.modified_variables = set()
+	#Variables not loaded by the DataBundle are still being read from self.filename, so write to a temporary file and then replace the restart.
+	def rewriteRestart(self):
+		self.data.restart_ds.to_netcdf(f'{self.filename}.tmp',encoding=si.getOutputEncoding(self.data.restart_ds,'restart',self.species_config))
+		self.data.restart_ds.close()
+		pathlib.Path(f'{self.filename}.tmp').replace(self.filename)
+	#Append the scaling factors added this window to the end of each file's unlimited time dimension, so the history is never rewritten.
+	#Files written before the time dimension was unlimited, or with integer times that cannot hold sub-daily windows, are rewritten once
+	#with an unlimited float time dimension in hours since the file's reference date, as in initialize_scaling_factors.py.
 	def saveEmissions(self):
 		for file in self.emis_sf_filenames:
 			name = '_'.join(file.split('/')[-1].split('_')[0:-1])
+			if name not in self.data.new_emis_sf:
+				continue
+			emis2d = self.data.new_emis_sf.pop(name)
 			if self.useLognormal:
-				self.data.emis_ds_list[name]['Scalar'] = np.exp(self.data.emis_ds_list[name]['Scalar']) #Right before saving, transform back to lognormal space if we are using lognormal errors
-			self.data.emis_ds_list[name].to_netcdf(file)
+				emis2d = np.exp(emis2d) #Right before saving, transform the new scaling factors back to lognormal space if we are using lognormal errors
+			self.data.emis_ds_list[name].close() #Release xarray's read-only handle before opening the file for writing
+			with netCDF4.Dataset(file,'a') as nc:
+				appendable = nc.dimensions['time'].isunlimited() and np.issubdtype(nc['time'].dtype, np.floating)
+				if appendable:
+					ntime = nc.dimensions['time'].size
+					calendar = nc['time'].calendar if 'calendar' in nc['time'].ncattrs() else 'standard'
+					nc['time'][ntime] = netCDF4.date2num(datetime.strptime(self.timestamp,'%Y%m%d_%H%M'),nc['time'].units,calendar=calendar)
+					nc['Scalar'][ntime,:,:] = emis2d
+					nc.History = f"The LETKF utility added new scaling factors on {str(date.today())}"
+			if not appendable:
+				if self.verbose>=2:
+					print(f"Rewriting {file} with an unlimited time dimension.")
+				original = xr.load_dataset(file)
+				reference_date = original['time'].encoding['units'].split(' since ')[-1]
+				time_encoding = {'dtype':'float64','units':f'hours since {reference_date}','calendar':original['time'].encoding.get('calendar','standard')}
+				ds = xr.concat([original,self.data.makeEmisSFDataset(name,emis2d)],dim = 'time')
+				ds['time'].encoding = time_encoding
+				ds.to_netcdf(file,unlimited_dims=['time'],encoding=si.getOutputEncoding(ds,'scalefactor',self.species_config))
 
 #Handles data getting and setting for emissions and concentrations.
 #Class exists to prevent mutual dependencies.
 class DataBundle(object):
 	def __init__(self,rst_filename,emis_sf_filenames,species_config,timestamp_as_string,timestamp_as_date,useLognormal,verbose,num=None):
-		self.restart_ds = xr.load_dataset(rst_filename)
 		self.species_config = species_config
+		#Open the restart lazily and only read in the variables CHEEREIO uses; others are read from disk only if accessed.
+		self.restart_ds = xr.open_dataset(rst_filename)
+		self.modified_variables = set() #Restart variables changed since loading; only these are written by GC_Translator.saveRestart
+		for variable in getRestartVariablesToLoad(species_config):
+			if variable in self.restart_ds:
+				self.restart_ds[variable].load()
 		self.verbose = verbose
 		self.timestamp = timestamp_as_string
 		self.timestamp_as_date = timestamp_as_date
@@ -155,13 +229,12 @@ class DataBundle(object):
 		if verbose >= 3:
 			self.num = num
 		self.emis_ds_list = {}
+		self.emis_times = {} #Time index of each scaling factor file, used to find the slice to read
+		self.new_emis_sf = {} #Scaling factors added by addEmisSF and not yet saved, by species
 		for file in emis_sf_filenames:
 			name = '_'.join(file.split('/')[-1].split('_')[0:-1])
-			self.emis_ds_list[name] = xr.load_dataset(file)
-			if self.useLognormal:
-				self.emis_ds_list[name]['Scalar'] = np.log(self.emis_ds_list[name]['Scalar']) #If we are using lognormal errors, convert to gaussian space immediately on import.
-				if self.verbose>=3:
-					print(f"GC_translator number {self.num} has log transformed scaling factors for {name}")
+			self.emis_ds_list[name] = xr.open_dataset(file) #Opened lazily; getEmisSF only reads the time slice it needs
+			self.emis_times[name] = np.array(self.emis_ds_list[name]['time'])
 			if self.verbose>=3:
 				print(f"GC_translator number {self.num} has loaded scaling factors for {name}")
 	#Since only one timestamp, returns in format lev,lat,lon
@@ -176,6 +249,7 @@ class DataBundle(object):
 		if self.verbose>=3:
 			print(f"GC_Translator number {self.num} set 3D conc for species {species} which are of dimension {np.shape(conc4d)}.")
 		self.restart_ds[f'SpeciesRst_{species}'] = (["time","lev","lat","lon"],conc4d,{"long_name":f"Dry mixing ratio of species {species}","units":"mol mol-1 dry","averaging_method":"instantaneous"})
+		self.modified_variables.add(f'SpeciesRst_{species}')
 	def setSpeciesConcByLayer(self, species, conc2d, layer):
 		da = self.getSpecies3Dconc(species)
 		da[layer,:,:] = conc2d #overwrite layer
@@ -214,22 +288,31 @@ class DataBundle(object):
 	def getRestartTime(self):
 		return np.array(self.restart_ds['time'])
 	def getEmisTime(self):
-		return np.array(list(self.emis_ds_list.values())[0]['time'])
-	#Get the emissions from the timestamp nearest to the one supplied by the user.
+		return list(self.emis_times.values())[0]
+	#Get the emissions from the timestamp nearest to the one supplied by the user, or those added by addEmisSF if there are any.
+	#If we are using lognormal errors, these are converted to gaussian space; only the slice returned is transformed.
 	def getEmisSF(self, species):
-		da = self.emis_ds_list[species]['Scalar']
-		time_array = self.getEmisTime()
-		ind_closest = np.argmin(np.abs(time_array-self.timestamp_as_date))
-		return np.array(da)[ind_closest,:,:].squeeze()
+		if species in self.new_emis_sf:
+			return self.new_emis_sf[species]
+		ind_closest = np.argmin(np.abs(self.emis_times[species]-self.timestamp_as_date))
+		sf = np.array(self.emis_ds_list[species]['Scalar'][ind_closest,:,:]).squeeze()
+		if self.useLognormal:
+			sf = np.log(sf)
+		return sf
 	def getEmisLat(self, species):
 		return np.array(self.emis_ds_list[species]['lat'])
 	def getEmisLon(self, species):
 		return np.array(self.emis_ds_list[species]['lon'])
-	#Add 2d emissions scaling factors to the end of the emissions scaling factor
+	#Release the read-only handles on the restart and scaling factor files. Variables already read stay in memory; others are reopened if accessed.
+	def closeFiles(self):
+		self.restart_ds.close()
+		for name in self.emis_ds_list:
+			self.emis_ds_list[name].close()
+	#Add 2d emissions scaling factors to the end of the emissions scaling factor; they are appended to the file by GC_Translator.saveEmissions.
 	def addEmisSF(self, species, emis2d):
-		timelist = self.getEmisTime()
-		last_time = timelist[-1]
-		#new_last_time = last_time+np.timedelta64(assim_time,'h') #Add assim time hours to the last timestamp
+		self.new_emis_sf[species] = emis2d
+	#Dataset holding one timestep of scaling factors at this timestamp, used when a scaling factor file has to be rewritten.
+	def makeEmisSFDataset(self, species, emis2d):
 		tstr = f'{self.timestamp[0:4]}-{self.timestamp[4:6]}-{self.timestamp[6:8]}T{self.timestamp[9:11]}:{self.timestamp[11:13]}:00.000000000'
 		new_last_time = np.datetime64(tstr)
 		if self.species_config['DO_ENS_SPINUP']=='true':
@@ -260,7 +343,7 @@ class DataBundle(object):
 				"End_Time":"0"
 			}
 		)
-		self.emis_ds_list[species] = xr.concat([self.emis_ds_list[species],ds],dim = 'time') #Concatenate
+		return ds
 
 
 class StateVector(object):
@@ -269,18 +352,11 @@ class StateVector(object):
 		self.StateVecFrom3D = MakeStateVecFrom3D(self.StateVecType)
 		if self.StateVecType == "3D":
 			self.ConcInterp = "3D" #All 3D concentration values present, interpret state vector appropriately.
-			self.params_needed = []
-		elif self.StateVecType == "surface":
-			self.ConcInterp = "2D" #One layer of concentrations effectively present, interpret state vector appropriately.
-			self.params_needed = []
-		elif self.StateVecType == "column_sum":
+		elif self.StateVecType in ["surface","column_sum","trop_sum"]:
 			self.ConcInterp = "2D" #One layer of concentrations effectively present, interpret state vector appropriately.
-			self.params_needed = ["temp","pres","height"]
-		elif self.StateVecType == "trop_sum":
-			self.ConcInterp = "2D" #One layer of concentrations effectively present, interpret state vector appropriately.
-			self.params_needed = ["temp","pres","height","trop"]
 		else:
 			raise ValueError(f"State vector type '{self.StateVecType}' not recognized.")
+		self.params_needed = PARAMS_NEEDED[self.StateVecType]
 		self.data = data #this is a databundle
 		self.verbose = verbose
 		if verbose >= 3:
@@ -305,6 +381,9 @@ class StateVector(object):
 				statevec_components.append(self.data.getEmisSF(spec_emis).flatten())
 		self.statevec_lengths = np.array([len(vec) for vec in statevec_components])
 		self.statevec = np.concatenate(statevec_components)
+		#Use precomputed localization tables from scratch if they exist; otherwise localize on the fly.
+		self.localization_table = lt.getLocalizationTable(self.species_config,self.verbose)
+		self.column_offsets = None
 		if self.verbose>=3:
 			print(f"GC_Translator number {self.num} has built statevector; it is of dimension {np.shape(self.statevec)}.")
 			print("*****************************************************************")
@@ -319,8 +398,50 @@ class StateVector(object):
 			dummy = np.arange(0, latcount*loncount).reshape((latcount,loncount))
 			incrementor = latcount*loncount
 		return [dummy,incrementor]
+	#Same as getIndices, but reads the surrounding cells from the precomputed localization table rather than
+	#building full-grid dummy arrays and calculating distances to every grid cell.
+	def getIndicesFromTable(self,latind,lonind,getSurroundings):
+		latcount = len(self.data.getLat())
+		loncount = len(self.data.getLon())
+		cellcount = latcount*loncount
+		levcount = len(self.data.getLev())
+		centre = (latind*loncount)+lonind
+		if getSurroundings != False:
+			surroundings = self.localization_table.getSurroundings(latind,lonind)
+			surrcount = len(surroundings)
+			if getSurroundings == 'intersect':
+				centre_position = self.localization_table.getCentrePosition(latind,lonind)
+				if self.ConcInterp == '3D':
+					conc_index = (np.arange(levcount)*surrcount)+centre_position
+					conc_incrementor = levcount*surrcount
+				else:
+					conc_index = np.array([centre_position])
+					conc_incrementor = surrcount
+				emis_index = np.array([centre_position])
+				emis_incrementor = surrcount
+			else:
+				if self.ConcInterp == '3D':
+					conc_index = ((np.arange(levcount)*cellcount)[:,np.newaxis]+surroundings[np.newaxis,:]).flatten()
+					conc_incrementor = levcount*cellcount
+				else:
+					conc_index = surroundings
+					conc_incrementor = cellcount
+				emis_index = surroundings
+				emis_incrementor = cellcount
+		else: #no surroundings
+			if self.ConcInterp == '3D':
+				conc_index = (np.arange(levcount)*cellcount)+centre
+				conc_incrementor = levcount*cellcount
+			else:
+				conc_index = np.array([centre])
+				conc_incrementor = cellcount
+			emis_index = np.array([centre])
+			emis_incrementor = cellcount
+		return [conc_index,conc_incrementor,emis_index,emis_incrementor]
 	#getSurroundings: True, False, or intersect (for column within localized statevec)
 	def getIndices(self,latind,lonind,getSurroundings):
+		if self.localization_table is not None:
+			return self.getIndicesFromTable(latind,lonind,getSurroundings)
 		dummyConc,conc_incrementor = self.makeDummy(self.ConcInterp) #Concentrations can be 3D or 2D depending on user settings
 		dummyEmis,emis_incrementor = self.makeDummy("2D")
 		if getSurroundings != False:
@@ -350,22 +471,51 @@ class StateVector(object):
 				conc_index = np.array([dummyConc[latind,lonind]])
 			emis_index = np.array([dummyEmis[latind,lonind]])
 		return [conc_index,conc_incrementor,emis_index,emis_incrementor]
+	#Offsets of each entry of a column within the full state vector, relative to the flattened cell index latind*nlon+lonind.
+	#The column at any cell is just these offsets plus its cell index, so no full-grid dummy arrays are needed. Cached after first use.
+	def getColumnOffsets(self):
+		if self.column_offsets is None:
+			cellcount = len(self.data.getLat())*len(self.data.getLon())
+			if self.ConcInterp == '3D':
+				levcount = len(self.data.getLev())
+				conc_offsets = np.arange(levcount)*cellcount
+				conc_incrementor = levcount*cellcount
+			else:
+				conc_offsets = np.array([0])
+				conc_incrementor = cellcount
+			ind_collector = []
+			cur_offset = 0
+			for i in range(len(self.species_config['STATE_VECTOR_CONC'])):
+				ind_collector.append(conc_offsets+cur_offset)
+				cur_offset+=conc_incrementor
+			for i in range(len(self.species_config['CONTROL_VECTOR_EMIS'])):
+				ind_collector.append(np.array([cur_offset]))
+				cur_offset+=cellcount
+			self.column_offsets = np.concatenate(ind_collector)
+		return self.column_offsets
+	#Full state vector indices of the columns at every (latinds[i],loninds[i]) at once, with dimension (number of cells, column length).
+	def getColumnIndicesForCells(self,latinds,loninds):
+		cells = (np.asarray(latinds,dtype=np.int64)*len(self.data.getLon()))+np.asarray(loninds,dtype=np.int64)
+		return self.getColumnOffsets()[np.newaxis,:]+cells[:,np.newaxis]
 	#old getLocalizedStateVectorIndices is getSurroundings = True; 
 	#old getColumnIndicesFromFullStateVector is getSurroundings = False; 
 	#old getColumnIndicesFromLocalizedStateVector is getSurroundings = 'intersect'
 	def localizeFromFull(self,latind,lonind,getSurroundings):
-		conc_index,conc_incrementor,emis_index,emis_incrementor = self.getIndices(latind,lonind,getSurroundings = getSurroundings)
-		conccount = len(self.species_config['STATE_VECTOR_CONC'])
-		emcount = len(self.species_config['CONTROL_VECTOR_EMIS'])
-		ind_collector = []
-		cur_offset = 0
-		for i in range(conccount):
-			ind_collector.append((conc_index+cur_offset))
-			cur_offset+=conc_incrementor
-		for i in range(emcount):
-			ind_collector.append((emis_index+cur_offset))
-			cur_offset+=emis_incrementor
-		statevecinds = np.concatenate(ind_collector)
+		if getSurroundings == False: #Single columns follow a fixed pattern, so skip building index arrays
+			statevecinds = self.getColumnIndicesForCells([latind],[lonind])[0]
+		else:
+			conc_index,conc_incrementor,emis_index,emis_incrementor = self.getIndices(latind,lonind,getSurroundings = getSurroundings)
+			conccount = len(self.species_config['STATE_VECTOR_CONC'])
+			emcount = len(self.species_config['CONTROL_VECTOR_EMIS'])
+			ind_collector = []
+			cur_offset = 0
+			for i in range(conccount):
+				ind_collector.append((conc_index+cur_offset))
+				cur_offset+=conc_incrementor
+			for i in range(emcount):
+				ind_collector.append((emis_index+cur_offset))
+				cur_offset+=emis_incrementor
+			statevecinds = np.concatenate(ind_collector)
 		if self.verbose>=3:
 			print(f"There are a total of {len(statevecinds)}/{len(self.statevec)} selected from total statevec.")
 		return statevecinds
@@ -3,6 +3,10 @@ from glob import glob
 import settings_interface as si 
 from datetime import date,datetime,timedelta
 from GC_Translator import GC_Translator
+from column_store import loadColumnContainers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 #Lightweight container for GC_Translators; used to combine columns, update restarts, and diff columns.
 class GT_Container(object):
@@ -11,10 +15,7 @@ class GT_Container(object):
 		path_to_ensemble = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/ensemble_runs"
 		self.path_to_scratch = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch"
 		if getAssimColumns:
-			npy_column_files = glob(f'{self.path_to_scratch}/**/*.npy',recursive=True)
-			npy_col_names = [file.split('/')[-1] for file in npy_column_files]
-			npy_columns = [np.load(file) for file in npy_column_files]
-			self.columns = dict(zip(npy_col_names,npy_columns))
+			self.columns = loadColumnContainers(self.path_to_scratch) #One memory-mapped container per LETKF core
 		else:
 			self.columns = None
 		subdirs = glob(f"{path_to_ensemble}/*/")
@@ -50,10 +51,10 @@ class GT_Container(object):
 				backgroundEnsemble[:,i-1] = self.gt[i].getStateVector()[colinds]
 		return backgroundEnsemble
 	def diffColumns(self,latind,lonind):
-		filenames = list(self.columns.keys())
-		substr = f'lat_{latind}_lon_{lonind}.npy'
-		search = [i for i in filenames if substr in i]
-		saved_col = self.columns[search[0]]
+		for container in self.columns:
+			saved_col = container.getColumn(latind,lonind)
+			if saved_col is not None:
+				break
 		backgroundEnsemble = self.constructColStatevec(latind,lonind)
 		diff = saved_col-backgroundEnsemble
 		return [saved_col,backgroundEnsemble,diff]
@@ -78,14 +79,23 @@ class GT_Container(object):
 		self.backgroundEnsemble = np.zeros((len(self.gt[1].getStateVector()),len(self.ensemble_numbers)))
 		for i in self.ensemble_numbers:
 			self.backgroundEnsemble[:,i-1] = self.gt[i].getStateVector()
-	def reconstructAnalysisEnsemble(self):
+	def initializeAnalysisEnsemble(self):
 		self.analysisEnsemble = np.zeros((len(self.gt[1].getStateVector()),len(self.ensemble_numbers)))
-		for name, cols in zip(self.columns.keys(),self.columns.values()):
-			split_name = name.split('_')
-			latind = int(split_name[-3])
-			lonind = int(split_name[-1].split('.')[0])
-			colinds = self.gt[1].getColumnIndicesFromFullStateVector(latind,lonind)
-			self.analysisEnsemble[colinds,:] = cols
+	#Scatter column containers into the analysis ensemble in a single assignment: row i of colinds holds the state vector indices of column i,
+	#built from the cached column offset pattern. Can be called with each core's container as it arrives, or with all containers at once.
+	def addColumnContainers(self,containers):
+		containers = [container for container in containers if len(container)>0]
+		if len(containers)==0:
+			return
+		latinds = np.concatenate([container.latinds for container in containers])
+		loninds = np.concatenate([container.loninds for container in containers])
+		colinds = self.gt[1].getColumnIndicesForCells(latinds,loninds)
+		self.analysisEnsemble[colinds,:] = np.concatenate([container.columns for container in containers])
+	def addColumnContainer(self,container):
+		self.addColumnContainers([container])
+	def reconstructAnalysisEnsemble(self):
+		self.initializeAnalysisEnsemble()
+		self.addColumnContainers(self.columns)
 	def updateRestartsAndScalingFactors(self):
 		for i in self.ensemble_numbers:
 			self.gt[i].reconstructArrays(self.analysisEnsemble[:,i-1])
@@ -119,9 +129,35 @@ class GT_Container(object):
 						print(f'Concentrations after RTPS have mean {np.mean(conc4D[:,ind0,ind1,ind2],axis=0)} and st. dev. {np.std(conc4D[:,ind0,ind1,ind2],axis=0)}')
 					for i in self.ensemble_numbers: 
 						self.gt[i].setSpecies3Dconc(species, conc4D[i-1,:,:,:])
-	def saveRestartsAndScalingFactors(self,saveRestart=True, saveEmissions=True):
-		for i in self.ensemble_numbers:
-			if saveRestart:
-				self.gt[i].saveRestart()
-			if saveEmissions:
-				self.gt[i].saveEmissions()
+	def saveRestartsAndScalingFactors(self,saveRestart=True, saveEmissions=True, nworkers=1):
+		self.mapOverMembers(nworkers,update=False,saveRestart=saveRestart,saveEmissions=saveEmissions)
+	#Reconstruct and save every member in one pass, so that with nworkers>1 both steps happen in the pool.
+	#Only use if nothing else needs the updated members afterwards (e.g. no additional inflation).
+	def updateAndSaveRestartsAndScalingFactors(self,nworkers=1):
+		self.mapOverMembers(nworkers,update=True,saveRestart=True,saveEmissions=True)
+	def updateAndSaveMember(self,ens,update=True,saveRestart=True,saveEmissions=True):
+		if update:
+			self.gt[ens].reconstructArrays(self.analysisEnsemble[:,ens-1])
+		if saveRestart:
+			self.gt[ens].saveRestart()
+		if saveEmissions:
+			self.gt[ens].saveEmissions()
+	#Run updateAndSaveMember for every ensemble member. If nworkers>1, members are handled by a pool of forked processes, which share this
+	#container copy-on-write; changes made in the workers are written to disk but not seen here. Any exception in a worker is raised here.
+	def mapOverMembers(self,nworkers,**kwargs):
+		if nworkers>1:
+			if self.verbose>=1:
+				print(f'Updating and saving {len(self.ensemble_numbers)} ensemble members with {nworkers} worker processes.')
+			global _pool_container
+			_pool_container = self
+			with ProcessPoolExecutor(max_workers=nworkers,mp_context=multiprocessing.get_context('fork')) as executor:
+				list(executor.map(partial(_updateAndSaveMemberFromPool,**kwargs),[int(ens) for ens in self.ensemble_numbers])) #list() raises any exception from the workers
+		else:
+			for ens in self.ensemble_numbers:
+				self.updateAndSaveMember(ens,**kwargs)
+
+#GT_Container shared with forked pool workers; set by mapOverMembers before the pool starts.
+_pool_container = None
+
+def _updateAndSaveMemberFromPool(ens,**kwargs):
+	_pool_container.updateAndSaveMember(ens,**kwargs)
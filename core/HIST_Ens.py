@@ -5,10 +5,14 @@ import omi_tools as ot
 import scipy.linalg as la
 from scipy.stats import linregress
 import toolbox as tx 
+import distance_tools as dt
 import settings_interface as si
+import os
 import os.path
+import time
 from datetime import date,datetime,timedelta
 from HIST_Translator import HIST_Translator
+from observation_operators import ObsData
 
 #USER: if you have implemented a new observation operator, add it to the operators.json file following the instructions on the Observations page in the documentation
 translators = si.importObsTranslators()
@@ -24,6 +28,8 @@ class HIST_Ens(object):
 		self.useSatDiagn = useSatDiagn
 		self.useControl = useControl
 		self.spc_config = si.getSpeciesConfig()
+		self.timestamp = timestamp
+		self.UseBigYCache = self.spc_config['USE_BIGY_CACHE'] == "True"
 		if self.verbose >=2:
 			print(f'HIST_Ens constructor called with the following arguments: HIST_Ens({timestamp},useLevelEdge={useLevelEdge},useStateMet={useStateMet},useObsPack={useObsPack},useArea={useArea},useSatDiagn={useSatDiagn},fullperiod={fullperiod},interval={interval},verbose={verbose},useControl={useControl})')
 		path_to_ensemble = f"{self.spc_config['MY_PATH']}/{self.spc_config['RUN_NAME']}/ensemble_runs"
@@ -71,6 +77,7 @@ class HIST_Ens(object):
 				self.control_ht = HIST_Translator(directory, self.timeperiod,verbose=self.verbose)
 		self.ensemble_numbers=np.array(ensemble_numbers)
 		self.maxobs=int(self.spc_config['MAXNUMOBS'])
+		self.localObs = None
 		self.interval=interval
 		if self.useArea:
 			self.AREA = self.ht[1].getArea()
@@ -95,14 +102,98 @@ class HIST_Ens(object):
 			includeObsError = errtype == 'product'
 			self.OBS_DATA[spec] = self.OBS_TRANSLATOR[spec].getObservations(spec,self.timeperiod,self.interval,includeObsError=includeObsError)
 	def makeBigY(self):
+		self.makeObsTrans()
+		if self.UseBigYCache: #BigY is built once per window by build_bigy.py; load it rather than reading every history file
+			self.bigYDict = self.loadBigYCache()
+		else:
+			self.getObsData()
+			self.bigYDict = self.getCols()
+		self.makeObsSpatialIndex()
+		self.makeObsSpaceEnsembleStats()
+		self.localObs = None
+	def getBigYCacheFilename(self):
+		return f"{self.spc_config['MY_PATH']}/{self.spc_config['RUN_NAME']}/scratch/bigy_cache_{self.timestamp}.npz"
+	#Build BigY from the history files and save it to scratch for all LETKF workers. Called once per window by build_bigy.py.
+	def buildBigYCache(self):
 		self.makeObsTrans()
 		self.getObsData()
 		self.bigYDict = self.getCols()
+		self.saveBigYCache()
+	#Save every array in the BigY ObsData objects (simulated and actual observations, locations, times, errors and extra fields)
+	#to a single uncompressed npz. Written to a temporary file and then renamed, so readers never see a partial cache.
+	def saveBigYCache(self):
+		filename = self.getBigYCacheFilename()
+		arrays = {'species':np.array(list(self.bigYDict.keys()))}
+		for i,species in enumerate(self.bigYDict):
+			obsdat = self.bigYDict[species]
+			arrays[f'{i}_gccol'],arrays[f'{i}_obscol'] = obsdat.getCols()
+			arrays[f'{i}_obslat'],arrays[f'{i}_obslon'] = obsdat.getLatLon()
+			arrays[f'{i}_obstime'] = obsdat.getTime()
+			arrays[f'{i}_additional_keys'] = np.array(list(obsdat.additional_data.keys()),dtype=str)
+			for key in obsdat.additional_data:
+				arrays[f'{i}_additional_{key}'] = obsdat.additional_data[key]
+		with open(f'{filename}.tmp','wb') as f:
+			np.savez(f,**arrays)
+		os.replace(f'{filename}.tmp',filename)
+		if self.verbose>=1:
+			print(f'Saved BigY cache to {filename}.')
+	#Load BigY from the cache, waiting for build_bigy.py to finish writing it if necessary.
+	def loadBigYCache(self,poll_seconds=2):
+		filename = self.getBigYCacheFilename()
+		kill_filename = f"{self.spc_config['MY_PATH']}/{self.spc_config['RUN_NAME']}/scratch/KILL_ENS"
+		while not os.path.isfile(filename):
+			if os.path.isfile(kill_filename):
+				raise RuntimeError(f'Ensemble killed while waiting for BigY cache {filename}.')
+			time.sleep(poll_seconds)
+		bigYDict = {}
+		with np.load(filename,allow_pickle=True) as cache:
+			for i,species in enumerate(cache['species']):
+				additional_data = {}
+				for key in cache[f'{i}_additional_keys']:
+					value = cache[f'{i}_additional_{key}']
+					if (value.dtype == object) and (value.ndim == 0): #Non-array entries (e.g. None) are stored as 0-d object arrays
+						value = value.item()
+					additional_data[str(key)] = value
+				bigYDict[str(species)] = ObsData(cache[f'{i}_gccol'],cache[f'{i}_obscol'],cache[f'{i}_obslat'],cache[f'{i}_obslon'],cache[f'{i}_obstime'],**additional_data)
+		if self.verbose>=2:
+			print(f'Loaded BigY cache from {filename}.')
+		return bigYDict
+	#Build a KD-tree over each species' observation locations once per window, so localization is a radius query rather than a scan over all observations.
+	def makeObsSpatialIndex(self):
+		self.obsSpatialIndex = {}
+		for species in self.bigYDict:
+			alllat,alllon = self.bigYDict[species].getLatLon()
+			self.obsSpatialIndex[species] = dt.SphericalPointIndex(alllat,alllon)
+	#Observation-space ensemble mean, perturbations and innovations for every observation in the window, computed once.
+	#Arrays are C-contiguous (perturbations are nobs x nens), so per-column work is a row gather.
+	def makeObsSpaceEnsembleStats(self):
+		self.obsMean = {}
+		self.obsPert = {}
+		self.obsDiff = {}
+		for species in self.bigYDict:
+			gccol,obscol = self.bigYDict[species].getCols()
+			obsmean = np.mean(gccol,axis=1)
+			self.obsMean[species] = obsmean
+			self.obsPert[species] = np.ascontiguousarray(gccol-obsmean[:,np.newaxis])
+			self.obsDiff[species] = obscol-obsmean
+	#Local observations for the current column. Computed once per column and shared by the Y-space and R-space calculations,
+	#so that both see exactly the same (possibly subsampled) observations.
+	def getLocalObs(self,latind,lonind):
+		if (self.localObs is None) or (self.localObs.latind != latind) or (self.localObs.lonind != lonind):
+			self.localObs = LocalObs(self,latind,lonind)
+		return self.localObs
+	#Gaspari cohn weights for observations at given distances from the column.
+	def getGaspariCohnWeights(self,distances):
+		loc_rad = float(self.spc_config['LOCALIZATION_RADIUS_km'])
+		gaco = tx.make_gaspari_cohn(loc_rad/2)
+		weights = gaco(distances) #will be between 0 and 1, shouldn't have anything at zero.
+		weights[weights<=0.001] = 0.001 #Set a floor so inverse doesn't explode
+		return weights
+	#Error variances for the observations of species at inds, with localization weights (or None) applied.
 	#Gamma^-1 applied in this stage. All calculations on a diagonal (vector) until return time
-	def makeRforSpecies(self,species,latind,lonind):
+	def calcObsErrorVariance(self,species,inds,weights=None):
 		errval = float(self.spc_config['OBS_ERROR'][species])
 		errtype = self.spc_config['OBS_ERROR_TYPE'][species]
-		inds,distances = self.getIndsOfInterest(species,latind,lonind,return_dist=True)
 		if self.spc_config['AV_TO_GC_GRID'][species]=="True": #If we are averaging to GC grid, the errors will be stored in the ObsData object.
 			obsdat = self.bigYDict[species]
 			err_av = obsdat.getDataByKey('err_av')
@@ -110,7 +201,7 @@ class HIST_Ens(object):
 			to_return = err_av**2
 		else:
 			if errtype=='absolute':
-				to_return = np.diag(np.repeat(errval**2,len(inds))) #we are assuming the user provides the square root of variance
+				to_return = np.repeat(errval**2,len(inds)) #we are assuming the user provides the square root of variance
 			elif errtype=='relative':
 				obsdat = self.bigYDict[species]
 				obscol = obsdat.getObsCol()
@@ -122,16 +213,14 @@ class HIST_Ens(object):
 				err_av = err_av[inds]
 				to_return = err_av**2
 		#Apply gaspari cohn localization.
-		if self.spc_config['smooth_localization_with_gaspari_cohn'].lower()=='true':
-			loc_rad = float(self.spc_config['LOCALIZATION_RADIUS_km'])
-			gaco = tx.make_gaspari_cohn(loc_rad/2)
-			weights = gaco(distances) #will be between 0 and 1, shouldn't have anything at zero.
-			weights[weights<=0.001] = 0.001 #Set a floor so inverse doesn't explode
+		if weights is not None:
 			to_return = (weights*to_return**-1)**-1 #Apply gaspari cohn to inverse of R.
 		#Apply gamma^-1, so that in the cost function we go from gamma^-1*R to gamma*R^-1
 		invgamma = self.getGamma(species)**-1
 		to_return*=invgamma
-		return np.diag(to_return) #Return as a diagonal matrix.
+		return to_return #Return the diagonal as a vector of variances.
+	def makeRforSpecies(self,species,latind,lonind):
+		return self.getLocalObs(latind,lonind).getRforSpecies(species)
 	def getGamma(self,species):
 		diffburnin = self.spc_config['USE_DIFFERENT_GAMMA_FOR_BURN_IN'][species] == "True"
 		doburnin = self.spc_config['SIMPLE_SCALE_AT_END_OF_BURN_IN_PERIOD'] == "true"
@@ -144,11 +233,15 @@ class HIST_Ens(object):
 		else:
 			gamma = float(self.spc_config['REGULARIZING_FACTOR_GAMMA'][species])
 		return gamma
+	#Observation errors are uncorrelated, so R is carried as the vector of variances along its diagonal.
+	def makeRVector(self,latind,lonind):
+		return self.getLocalObs(latind,lonind).R
+	#Dense version of R, kept for future work with correlated observation errors.
 	def makeR(self,latind,lonind):
 		errmats = []
 		for spec in self.obsSpecies:
 			if self.assimilate_observation[spec]: #If assimilation is turned on, add it to R.
-				errmats.append(self.makeRforSpecies(spec,latind,lonind))
+				errmats.append(np.diag(self.makeRforSpecies(spec,latind,lonind)))
 		return la.block_diag(*errmats)
 	def calcExtrapolationCoefficients(self,species_to_extrapolate):
 		gc_version = float(self.spc_config['GC_VERSION'][0:-2])
@@ -252,41 +345,56 @@ class HIST_Ens(object):
 		origlat,origlon = si.getLatLonVals(self.spc_config)
 		latval = origlat[latind]
 		lonval = origlon[lonind]
-		alllat,alllon = self.bigYDict[species].getLatLon()
-		distvec = np.array([tx.calcDist_km(latval,lonval,a,b) for a,b in zip(alllat,alllon)])
-		inds = np.where(distvec<=loc_rad)[0]
+		inds,distvec = self.obsSpatialIndex[species].queryRadius(latval,lonval,loc_rad)
 		if len(inds) > self.maxobs:
-			inds = np.random.choice(inds, self.maxobs,replace=False) #Randomly subset down to appropriate number of observations
+			subset = np.random.choice(len(inds), self.maxobs,replace=False) #Randomly subset down to appropriate number of observations
+			inds = inds[subset]
+			distvec = distvec[subset]
 		if return_dist:
-			return [inds,distvec[inds]]
+			return [inds,distvec]
 		else:
 			return inds
 	def getScaling(self,species):
-			gccol,obscol = self.bigYDict[species].getCols()
-			obsmean = np.mean(gccol,axis=1)
-			scaling = np.mean(obscol)/np.mean(obsmean)
+			obscol = self.bigYDict[species].getObsCol()
+			scaling = np.mean(obscol)/np.mean(self.obsMean[species])
 			return scaling
 	def getLocObsMeanPertDiff(self,latind,lonind):
+		localobs = self.getLocalObs(latind,lonind)
+		return [localobs.ybar,localobs.Ypert,localobs.ydiff]
+
+#Everything the LETKF needs in observation space for one column: which observations are in range, their distances and
+#localization weights, the local ensemble mean, perturbations and innovations, and the error variances (diagonal of R).
+#Observations are selected (and randomly subsampled, if more than MAXNUMOBS are in range) exactly once.
+class LocalObs(object):
+	def __init__(self,histens,latind,lonind):
+		self.latind = latind
+		self.lonind = lonind
+		self.species = []
+		self.inds = {}
+		self.distances = {}
+		self.weights = {}
+		self.errvar = {}
+		useGaspariCohn = histens.spc_config['smooth_localization_with_gaspari_cohn'].lower()=='true'
 		obsmeans = []
 		obsperts = []
 		obsdiffs = []
-		for spec in self.obsSpecies:
-			if self.assimilate_observation[spec]: #If assimilation is turned on, add it to R.
-				ind = self.getIndsOfInterest(spec,latind,lonind)
-				errtype = self.spc_config['OBS_ERROR_TYPE'][spec]
-				useError = errtype=='product'
-				gccol,obscol = self.bigYDict[spec].getCols()
-				gccol = gccol[ind,:]
-				obscol = obscol[ind]
-				obsmean = np.mean(gccol,axis=1)
-				obspert = np.zeros(np.shape(gccol))
-				for i in range(np.shape(gccol)[1]):
-					obspert[:,i]=gccol[:,i]-obsmean
-				obsdiff = obscol-obsmean
-				obsmeans.append(obsmean)
-				obsperts.append(obspert)
-				obsdiffs.append(obsdiff)
-		full_obsmeans = np.concatenate(obsmeans)
-		full_obsperts = np.concatenate(obsperts,axis = 0)
-		full_obsdiffs = np.concatenate(obsdiffs)
-		return [full_obsmeans,full_obsperts,full_obsdiffs]
+		for spec in histens.obsSpecies:
+			if histens.assimilate_observation[spec]: #If assimilation is turned on, add it to Y and R.
+				inds,distances = histens.getIndsOfInterest(spec,latind,lonind,return_dist=True)
+				self.species.append(spec)
+				self.inds[spec] = inds
+				self.distances[spec] = distances
+				if useGaspariCohn:
+					self.weights[spec] = histens.getGaspariCohnWeights(distances)
+				else:
+					self.weights[spec] = None
+				obsmeans.append(histens.obsMean[spec][inds])
+				obsperts.append(histens.obsPert[spec][inds,:])
+				obsdiffs.append(histens.obsDiff[spec][inds])
+				self.errvar[spec] = histens.calcObsErrorVariance(spec,inds,self.weights[spec])
+		self.ybar = np.concatenate(obsmeans)
+		self.Ypert = np.concatenate(obsperts,axis = 0)
+		self.ydiff = np.concatenate(obsdiffs)
+		self.R = np.concatenate([self.errvar[spec] for spec in self.species]) #Vector of variances along the diagonal of R
+	def getRforSpecies(self,species):
+		return self.errvar[species]
@@ -0,0 +1,35 @@
+from HIST_Ens import HIST_Ens
+import sys
+import time
+import settings_interface as si 
+from os.path import isfile
+
+#Build the observation-space ensemble (BigY) once per assimilation window, after all ensemble runs complete,
+#and save it to scratch. All LETKF workers then load this cache rather than each reading every history file.
+
+data = si.getSpeciesConfig()
+path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
+timestamp = str(sys.argv[1]) #Time to assimilate. Expected in form YYYYMMDD_HHMM, UTC time.
+verbose = int(data['verbose'])
+
+#BigY is not used when we are extrapolating trends for an approximate rerun (same logic as in Assimilator).
+do_approx = False
+if (data['DO_VARON_RERUN'] == 'True') and (data['APPROXIMATE_VARON_RERUN'] == 'True'):
+	with open(f"{path_to_scratch}/APPOXIMATION_STAGE") as f:
+		lines = f.readlines()
+		if lines[0] == 'true':
+			if not isfile(f"{path_to_scratch}/IS_FIRST"): #If we are in the first run, don't do an approximation
+				do_approx = True
+
+if do_approx:
+	print(f'Extrapolating trends at {timestamp}; BigY is not needed.')
+else:
+	print(f'Building BigY at time {timestamp}.')
+	start = time.time()
+	#Same settings as the Assimilator that saves BigY for postprocessing, so the cache serves every worker.
+	histens = HIST_Ens(timestamp,useLevelEdge=data["SaveLevelEdgeDiags"] == "True",useStateMet = data["SaveStateMet"] == "True",useObsPack = data["ACTIVATE_OBSPACK"] == "true",useArea=data["SaveArea"] == "True",useControl=data['DO_CONTROL_RUN']=="true",verbose=verbose)
+	histens.buildBigYCache()
+	end = time.time()
+	print(f'Built BigY in {end - start} seconds.')
+
+print('-------------------END BUILD BIGY-------------------')
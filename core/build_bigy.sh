@@ -0,0 +1,21 @@
+#!/bin/bash
+eval "$(conda shell.bash hook)"
+
+#Build the observation-space ensemble (BigY) once for this assimilation window, to be shared by all LETKF workers.
+MY_PATH="$(jq -r ".MY_PATH" ../ens_config.json)"
+RUN_NAME="$(jq -r ".RUN_NAME" ../ens_config.json)"
+CONDA_ENV=$(jq -r ".CondaEnv" ../ens_config.json)
+
+end_timestamp="$(tail -n 1 ${MY_PATH}/${RUN_NAME}/scratch/INPUT_GEOS_TEMP)"
+end_timestamp="${end_timestamp%??}" #Clear last two characters
+end_timestamp="${end_timestamp// /_}" #Replace space with underscore
+    
+source activate ${CONDA_ENV} #Activate conda environment.
+python -u build_bigy.py ${end_timestamp} >> ${MY_PATH}/${RUN_NAME}/ensemble_runs/logs/build_bigy.out
+py_exit_status=$?
+conda deactivate #Exit Conda environment
+
+#If python does not exit with exit code one, make file that will break loop
+if [ $py_exit_status != 0 ]; then
+	printf "Python BigY build script exited without code 0 \n" > ${MY_PATH}/${RUN_NAME}/scratch/KILL_ENS #This file's presence will break loop
+fi
@@ -6,14 +6,15 @@ MY_PATH="$(jq -r ".MY_PATH" ../ens_config.json)"
 RUN_NAME="$(jq -r ".RUN_NAME" ../ens_config.json)"
 CONDA_ENV=$(jq -r ".CondaEnv" ../ens_config.json)
 SIMPLE_SCALE_FOR_FIRST_ASSIM_PERIOD="$(jq -r ".SIMPLE_SCALE_FOR_FIRST_ASSIM_PERIOD" ../ens_config.json)"
+STREAMING_COMBINE="$(jq -r ".STREAMING_COMBINE" ../ens_config.json)"
 TESTSTR='PRODUCTION'
 
 end_timestamp="$(tail -n 1 ${MY_PATH}/${RUN_NAME}/scratch/INPUT_GEOS_TEMP)"
 end_timestamp="${end_timestamp%??}" #Clear last two characters
 end_timestamp="${end_timestamp// /_}" #Replace space with underscore
 
-#If we are not doing simple scaling, we need to do the actual work to combine columns.
-if [ "${1}" = false ]; then
+#If we are not doing simple scaling, we need to do the actual work to combine columns (unless stream_combine.sh is already doing it).
+if [ "${1}" = false ] && [ "${STREAMING_COMBINE}" != "True" ]; then
 
 	source activate ${CONDA_ENV} #Activate conda environment.
 	python check_for_all_columns.py
@@ -24,6 +25,7 @@ if [ "${1}" = false ]; then
 		if [ $py_exit_status != 0 ]; then
 			printf "Python combine columns script exited without code 0 \n" > ${MY_PATH}/${RUN_NAME}/scratch/KILL_ENS #This file's presence will break loop
 		else
+			python -u repartition_columns.py ${end_timestamp} >> ${MY_PATH}/${RUN_NAME}/ensemble_runs/logs/letkf_master.out #Rebalance columns across cores for the next window; falls back to the existing split on failure.
 			echo 'Done' > ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE
 		fi
 	fi
@@ -1,12 +1,11 @@
-from glob import glob
 import settings_interface as si 
+from column_store import countAssimilatedColumns
 
 data = si.getSpeciesConfig()
 latgrid,longrid = si.getLatLonVals(data)
 
 path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
-columns = glob(f'{path_to_scratch}/**/*.npy',recursive=True)
-numcols = len(columns)
+numcols = countAssimilatedColumns(path_to_scratch)
 num_cells = len(latgrid)*len(longrid)
 
 if numcols==num_cells:
@@ -29,4 +29,13 @@ rm ${MY_PATH}/${RUN_NAME}/scratch/ALL_COLUMNS_FOUND
 rm ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE
 
 #Remove columns
-find ${MY_PATH}/${RUN_NAME}/scratch/ -name "*.npy" -type f -delete
\ No newline at end of file
+find ${MY_PATH}/${RUN_NAME}/scratch/ -name "*_columns.*" -type f -delete
+
+#Remove this window's shared ensemble cube
+rm -f ${MY_PATH}/${RUN_NAME}/scratch/ensemble_cube/statevec_cube_*
+
+#Remove this window's BigY cache
+rm -f ${MY_PATH}/${RUN_NAME}/scratch/bigy_cache_*
+
+#Remove this window's column queue claims
+rm -rf ${MY_PATH}/${RUN_NAME}/scratch/column_queue/*
\ No newline at end of file
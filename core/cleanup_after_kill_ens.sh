@@ -16,7 +16,12 @@ rm ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE
 rm ${MY_PATH}/${RUN_NAME}/scratch/KILL_ENS
 
 #Remove columns
-find ${MY_PATH}/${RUN_NAME}/scratch/ -name "*.npy" -type f -delete
+find ${MY_PATH}/${RUN_NAME}/scratch/ -name "*_columns.*" -type f -delete
+
+#Remove this window's shared ensemble cube, BigY cache, and column queue claims
+rm -f ${MY_PATH}/${RUN_NAME}/scratch/ensemble_cube/statevec_cube_*
+rm -f ${MY_PATH}/${RUN_NAME}/scratch/bigy_cache_*
+rm -rf ${MY_PATH}/${RUN_NAME}/scratch/column_queue/*
 
 #Remove restart from end of run; this is because it can mess up job control
 #Better to just rerun the latest GC iteration.
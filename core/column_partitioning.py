@@ -0,0 +1,138 @@
+import numpy as np
+import json
+import heapq
+import pathlib
+import pickle
+from glob import glob
+from os.path import isfile
+import localization_tools as lt
+
+#Tools to divide the grid cells (columns) to be assimilated among ensemble members and their cores, saved to scratch/latlon_par.json.
+#By default cells are split evenly by count. If observation locations from a previous assimilation window are available,
+#cells are instead split so that every core gets roughly the same estimated LETKF cost, using greedy longest-processing-time (LPT) bin packing.
+
+#Split inds into n contiguous chunks whose sizes differ by at most one (the original CHEEREIO split).
+def splitEvenly(inds,n):
+	min_cells = np.floor(len(inds)/n)
+	remainder_cells = len(inds)%n
+	count_array = np.repeat(min_cells,n)
+	count_array[0:remainder_cells] = min_cells+1
+	endpoints = np.insert(np.cumsum(count_array),0,0).astype(int)
+	return [inds[endpoints[i]:endpoints[i+1]] for i in range(n)]
+
+#Even split by count: first across ensemble members, then across cores within each member. Returns a list of nens*ncore index arrays.
+def evenPartition(ncells,nens,ncore):
+	bins = []
+	for ensinds in splitEvenly(np.arange(ncells),nens):
+		bins.extend(splitEvenly(ensinds,ncore))
+	return bins
+
+#Greedy LPT bin packing: assign cells from most to least expensive, each to the bin with the smallest total cost so far.
+#Cells within each bin are returned in grid order.
+def lptPartition(costs,nbins):
+	heap = [(0.0,b) for b in range(nbins)]
+	assignment = np.zeros(len(costs),dtype=int)
+	for cell in np.argsort(-costs,kind='stable'):
+		load,b = heapq.heappop(heap)
+		assignment[cell] = b
+		heapq.heappush(heap,(load+costs[cell],b))
+	return [np.where(assignment==b)[0] for b in range(nbins)]
+
+#Observation locations from a previous window: the BigY cache for timestamp if present, otherwise the most recent postprocessing BigY.
+#Returns None if neither can be read.
+def getPreviousObservationLocations(spc_config,timestamp=None):
+	path_to_sim = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}"
+	cache = f"{path_to_sim}/scratch/bigy_cache_{timestamp}.npz"
+	if (timestamp is not None) and isfile(cache):
+		with np.load(cache,allow_pickle=True) as f:
+			obslat = np.concatenate([f[f'{i}_obslat'] for i in range(len(f['species']))])
+			obslon = np.concatenate([f[f'{i}_obslon'] for i in range(len(f['species']))])
+		return [obslat,obslon]
+	bigy_files = sorted(glob(f"{path_to_sim}/postprocess/bigy/*.pkl"))
+	for bigy_file in bigy_files[::-1]: #Newest first; a file may still be being written, so fall back to older ones
+		try:
+			with open(bigy_file,'rb') as f:
+				bigy = pickle.load(f)
+			obslat = np.concatenate([np.array(bigy[spec]['Latitude']) for spec in bigy])
+			obslon = np.concatenate([np.array(bigy[spec]['Longitude']) for spec in bigy])
+			return [obslat,obslon]
+		except Exception:
+			continue
+	return None
+
+#Flattened (lat,lon) index of the grid cell nearest each observation. Longitudes wrap around, so observations east of the
+#midpoint between the last and first grid longitudes (near 180 degrees on a global grid) are assigned to the first column.
+def getObservationCells(lat,lon,obslat,obslon):
+	lat = np.array(lat)
+	lon = np.array(lon)
+	latinds = np.searchsorted((lat[1:]+lat[:-1])/2,obslat)
+	lon_ext = np.append(lon,lon[0]+360)
+	obslon_wrapped = ((np.array(obslon)-lon[0])%360)+lon[0] #Shift into [lon[0],lon[0]+360)
+	loninds = np.searchsorted((lon_ext[1:]+lon_ext[:-1])/2,obslon_wrapped)%len(lon)
+	return (latinds*len(lon))+loninds
+
+#Relative LETKF cost of each grid cell. A column with n state vector entries, p local observations and k ensemble members
+#costs roughly n*k to gather and update, p*k for the observation-space ensemble, and k^3 for the weights, so per k:
+#cost = n + p + k^2, where p is capped at MAXNUMOBS. Columns with fewer than MINNUMOBS observations just copy the prior (cost n).
+def estimateColumnCosts(spc_config,lat,lon,obslat,obslon,column_length):
+	nlat = len(lat)
+	nlon = len(lon)
+	k = int(spc_config['nEnsemble'])
+	maxobs = int(spc_config['MAXNUMOBS'])
+	minobs = int(spc_config['MINNUMOBS'])
+	#Count observations in each grid cell, then over each cell's localization neighbourhood
+	counts = np.bincount(getObservationCells(lat,lon,obslat,obslon),minlength=nlat*nlon).astype(float)
+	table = lt.getLocalizationTable(spc_config,verbose=0)
+	if table is not None:
+		local_counts = np.add.reduceat(counts[np.array(table.indices)],np.array(table.indptr[0:-1]))
+	else:
+		local_counts = counts
+	nobs = np.minimum(local_counts,maxobs)
+	return column_length + np.where(nobs>=minobs,nobs+(k**2),0)
+
+#Number of state vector entries per column, from the saved grid information and the state vector settings.
+def getColumnLength(spc_config,nlev):
+	nconc = len(spc_config['STATE_VECTOR_CONC'])
+	nemis = len(spc_config['CONTROL_VECTOR_EMIS'])
+	if spc_config['STATE_VECTOR_CONC_REPRESENTATION'] == '3D':
+		return (nlev*nconc)+nemis
+	else:
+		return nconc+nemis
+
+#Write the partition to scratch/latlon_par.json, making the scratch folders for each ensemble member and core.
+def saveLatLonPar(spc_config,lat,lon,bins,nens,ncore):
+	path_to_scratch = f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch"
+	lat_full_list = np.repeat(np.arange(len(lat)),len(lon))
+	lon_full_list = np.tile(np.arange(len(lon)),len(lat))
+	dict_to_save = {}
+	for i in range(nens):
+		subdirstring = str(i+1).zfill(3)
+		subdict = {}
+		for j in range(ncore):
+			corestring = str(j+1).zfill(3)
+			pathlib.Path(f"{path_to_scratch}/{subdirstring}/{corestring}").mkdir(parents=True, exist_ok=True)
+			cells = bins[(i*ncore)+j]
+			subdict[j+1] = {'lat':lat_full_list[cells].tolist(),'lon':lon_full_list[cells].tolist()}
+		dict_to_save[i+1] = subdict
+	with open(f"{path_to_scratch}/latlon_par.json.tmp", "w") as f:
+		json.dump(dict_to_save, f, indent = 6)
+	pathlib.Path(f"{path_to_scratch}/latlon_par.json.tmp").replace(f"{path_to_scratch}/latlon_par.json")
+
+#Make and save the column partition. Uses cost-aware LPT packing if enabled and observation locations are available, otherwise an even split.
+def makeColumnPartition(spc_config,lat,lon,nlev,timestamp=None,verbose=1):
+	nens = int(spc_config['nEnsemble'])
+	ncore = int(spc_config['MaxPar'])
+	obslocs = None
+	if spc_config['COST_AWARE_COLUMN_PARTITIONING'] == "True":
+		obslocs = getPreviousObservationLocations(spc_config,timestamp)
+	if obslocs is None:
+		if verbose>=1:
+			print('Partitioning columns evenly by count.')
+		bins = evenPartition(len(lat)*len(lon),nens,ncore)
+	else:
+		costs = estimateColumnCosts(spc_config,lat,lon,obslocs[0],obslocs[1],getColumnLength(spc_config,nlev))
+		bins = lptPartition(costs,nens*ncore)
+		if verbose>=1:
+			loads = np.array([np.sum(costs[b]) for b in bins])
+			print(f'Partitioned columns by estimated cost from {len(obslocs[0])} observations; max/mean core load is {np.max(loads)/np.mean(loads)} (even split: {np.max([np.sum(costs[b]) for b in evenPartition(len(costs),nens,ncore)])/np.mean(loads)}).')
+	saveLatLonPar(spc_config,lat,lon,bins,nens,ncore)
@@ -0,0 +1,62 @@
+import numpy as np
+import os
+import pathlib
+import settings_interface as si
+
+#Dynamic (work-stealing) scheduling of LETKF columns. The static split in scratch/latlon_par.json is cut into chunks of a few columns.
+#Each LETKF worker first works through the chunks of its own (ensemble member, core) list, then steals unclaimed chunks from the
+#ends of the other workers' lists, so fast workers absorb the tail of slow ones. A chunk is claimed by atomically creating a claim file
+#in scratch/column_queue/{timestamp}, so every chunk is assimilated exactly once across all jobs without a server or database.
+#Columns are still saved to the claiming core's column container, so check_for_all_columns.py is unaffected.
+
+def getColumnQueuePath(spc_config):
+	return f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch/column_queue"
+
+class ColumnQueue(object):
+	def __init__(self,path,timestamp,chunksize,verbose=1):
+		self.claim_path = f'{path}/{timestamp}'
+		pathlib.Path(self.claim_path).mkdir(parents=True, exist_ok=True)
+		self.verbose = verbose
+		self.chunks = {} #Dictionary of (ensnum,corenum) to list of (latinds,loninds) chunks
+		gridsplit = si.getLatLonPar()
+		for ens in gridsplit:
+			for core in gridsplit[ens]:
+				latinds = np.array(gridsplit[ens][core]['lat'],dtype=int)
+				loninds = np.array(gridsplit[ens][core]['lon'],dtype=int)
+				self.chunks[(int(ens),int(core))] = [(latinds[i:i+chunksize],loninds[i:i+chunksize]) for i in range(0,len(latinds),chunksize)]
+		self.owners = sorted(self.chunks.keys())
+	#Atomically claim a chunk; exactly one worker succeeds.
+	def claim(self,owner,chunknum):
+		try:
+			fd = os.open(f'{self.claim_path}/chunk_{owner[0]}_{owner[1]}_{chunknum}.claim',os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			return False
+		os.write(fd,f'{os.getpid()}\n'.encode())
+		os.close(fd)
+		return True
+	#Order in which a worker tries chunks: its own from the front, then the other workers' from the back, interleaved across
+	#the other workers (starting after this one) so that thieves spread out rather than all raiding the same list.
+	def getClaimOrder(self,ensnum,corenum):
+		me = (ensnum,corenum)
+		order = [(me,i) for i in range(len(self.chunks[me]))]
+		mypos = self.owners.index(me)
+		victims = self.owners[mypos+1:]+self.owners[0:mypos]
+		maxlen = np.max([len(self.chunks[victim]) for victim in victims]) if len(victims)>0 else 0
+		for fromback in range(maxlen):
+			for victim in victims:
+				nchunk = len(self.chunks[victim])
+				if fromback<nchunk:
+					order.append((victim,nchunk-1-fromback))
+		return order
+	#Yields (latinds,loninds) for every chunk this worker claims, until no unclaimed chunks remain.
+	def claimChunks(self,ensnum,corenum):
+		nstolen = 0
+		for owner,chunknum in self.getClaimOrder(ensnum,corenum):
+			if self.claim(owner,chunknum):
+				if owner != (ensnum,corenum):
+					nstolen+=1
+					if self.verbose>=2:
+						print(f"Core ({ensnum},{corenum}) took chunk {chunknum} of core {owner}.")
+				yield self.chunks[owner][chunknum]
+		if self.verbose>=1:
+			print(f"Core ({ensnum},{corenum}) found no more unclaimed columns; it took {nstolen} chunks from other cores.")
@@ -0,0 +1,81 @@
+import numpy as np
+import json
+import pathlib
+from glob import glob
+
+#One container of assimilated columns per LETKF core (or pool task) per assimilation window, rather than one .npy file per grid cell.
+#While it works, a core appends each analysis column (column state vector entries x ensemble members) to a raw binary file.
+#When it finishes, it writes a JSON index holding the lat/lon indices of each column in order, the column shape, and the dtype.
+#The index is written last and atomically, so check_for_all_columns.py and GT_Container only ever see complete containers.
+
+def getColumnContainerPrefix(path_to_scratch,ensnum,corenum,parfilename):
+	return f'{path_to_scratch}/{str(ensnum).zfill(3)}/{str(corenum).zfill(3)}/{parfilename}_columns'
+
+#Prefixes of all complete containers in scratch.
+def getColumnContainerPrefixes(path_to_scratch):
+	return [file[0:-len('.json')] for file in glob(f'{path_to_scratch}/**/*_columns.json',recursive=True)]
+
+#Number of columns in all complete containers; only the small index files are read.
+def countAssimilatedColumns(path_to_scratch):
+	count = 0
+	for prefix in getColumnContainerPrefixes(path_to_scratch):
+		with open(f'{prefix}.json') as f:
+			count += len(json.load(f)['lat'])
+	return count
+
+def loadColumnContainers(path_to_scratch):
+	return [ColumnContainer(prefix) for prefix in getColumnContainerPrefixes(path_to_scratch)]
+
+class ColumnWriter(object):
+	def __init__(self,prefix):
+		self.prefix = prefix
+		pathlib.Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+		self.latinds = []
+		self.loninds = []
+		self.shape = None
+		self.dtype = None
+		self.f = open(f'{prefix}.bin','wb')
+	def write(self,latind,lonind,column):
+		if self.shape is None:
+			self.shape = np.shape(column)
+			self.dtype = np.asarray(column).dtype
+		elif np.shape(column) != self.shape:
+			raise ValueError(f'Column at {(latind,lonind)} has shape {np.shape(column)}, but columns in {self.prefix} have shape {self.shape}.')
+		self.f.write(np.ascontiguousarray(column,dtype=self.dtype).tobytes())
+		self.latinds.append(int(latind))
+		self.loninds.append(int(lonind))
+	def close(self):
+		self.f.close()
+		index = {'lat':self.latinds,'lon':self.loninds}
+		if self.shape is None: #No columns written
+			index['shape'] = [0,0]
+			index['dtype'] = 'float64'
+		else:
+			index['shape'] = [int(n) for n in self.shape]
+			index['dtype'] = str(self.dtype)
+		with open(f'{self.prefix}.json.tmp', 'w') as f:
+			json.dump(index, f)
+		pathlib.Path(f'{self.prefix}.json.tmp').replace(f'{self.prefix}.json')
+
+#Read-only view of a complete container. columns has dimension (number of columns, column length, number of ensemble members)
+#and is memory-mapped, so columns are only read from disk when used.
+class ColumnContainer(object):
+	def __init__(self,prefix):
+		self.prefix = prefix
+		with open(f'{prefix}.json') as f:
+			index = json.load(f)
+		self.latinds = np.array(index['lat'],dtype=int)
+		self.loninds = np.array(index['lon'],dtype=int)
+		shape = (len(self.latinds),*index['shape'])
+		if len(self.latinds)>0:
+			self.columns = np.memmap(f'{prefix}.bin',dtype=index['dtype'],mode='r',shape=shape)
+		else:
+			self.columns = np.zeros(shape,dtype=index['dtype'])
+	def __len__(self):
+		return len(self.latinds)
+	#Returns the saved column at latind,lonind, or None if it is not in this container.
+	def getColumn(self,latind,lonind):
+		match = np.where((self.latinds==latind) & (self.loninds==lonind))[0]
+		if len(match)==0:
+			return None
+		return np.array(self.columns[match[0]])
@@ -2,12 +2,15 @@ from glob import glob
 import settings_interface as si 
 import sys 
 from GT_Container import GT_Container
+import column_store as cs
 import time
 import numpy as np
 import os
+from os.path import isfile
 from datetime import datetime,timedelta
 
 timestamp = str(sys.argv[1]) #Time to assimilate. Expected in form YYYYMMDD_HHMM, UTC time.
+stream = (len(sys.argv)>2) and (str(sys.argv[2])=='stream') #If true, start while LETKF is running and combine each core's columns as they arrive.
 
 data = si.getSpeciesConfig()
 path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
@@ -24,6 +27,12 @@ DO_RERUN = data["DO_VARON_RERUN"] == "True"
 if DO_RERUN:
 	number_of_windows_to_rerun = int(data["number_of_windows_to_rerun"])
 	APPROXIMATE_VARON_RERUN = data["APPROXIMATE_VARON_RERUN"] == "True"
+	if stream and APPROXIMATE_VARON_RERUN:
+		with open(f"{path_to_scratch}/APPOXIMATION_STAGE") as f:
+			lines = f.readlines()
+		if lines[0] == 'true':
+			print('Extrapolating trends; no columns will be assimilated, so the streaming combine is not needed.')
+			sys.exit(3) #Tells stream_combine.sh that there was nothing to do
 
 with open(f"{path_to_scratch}/ACTUAL_RUN_IN_PLACE_ASSIMILATION_WINDOW") as f:
     lines = f.readlines()
@@ -79,20 +88,51 @@ if timestamp_restart is not None:
 	timestamp = timestamp_restart 
 
 SaveDOFS = data["SaveDOFS"] == "True"
+COMBINE_WRITE_WORKERS = int(data["COMBINE_WRITE_WORKERS"]) #Number of processes updating and writing ensemble members in parallel
 
 dateval = timestamp[0:4]+'-'+timestamp[4:6]+'-'+timestamp[6:8]
 
-print(f'One core is gathering columns to overwrite at time {dateval}.')
-start = time.time()
-wrapper = GT_Container(timestamp)
-end = time.time()
-print(f'Core gathered columns and ensemble in {end - start} seconds. Begin saving.')
-start = time.time()
-wrapper.reconstructAnalysisEnsemble()
-wrapper.updateRestartsAndScalingFactors()
+if stream:
+	print(f'One core is gathering the ensemble at time {dateval}; columns will be combined as each LETKF core finishes.')
+	start = time.time()
+	wrapper = GT_Container(timestamp,getAssimColumns=False)
+	wrapper.initializeAnalysisEnsemble()
+	latgrid,longrid = si.getLatLonVals(data)
+	num_cells = len(latgrid)*len(longrid)
+	combined = set()
+	numcols = 0
+	while numcols<num_cells:
+		if isfile(f'{path_to_scratch}/KILL_ENS') or isfile(f'{path_to_scratch}/ASSIMILATION_COMPLETE'):
+			print('Ensemble killed or assimilation completed elsewhere; streaming combine exiting.')
+			sys.exit(3)
+		new_prefixes = [prefix for prefix in cs.getColumnContainerPrefixes(path_to_scratch) if prefix not in combined]
+		for prefix in new_prefixes:
+			container = cs.ColumnContainer(prefix)
+			wrapper.addColumnContainer(container)
+			combined.add(prefix)
+			numcols += len(container)
+			if int(data['verbose'])>=2:
+				print(f'Combined {len(container)} columns from {prefix}; {numcols} of {num_cells} columns combined.')
+		if len(new_prefixes)==0:
+			time.sleep(1)
+	end = time.time()
+	print(f'Core gathered ensemble and combined all columns {end - start} seconds after starting. Begin saving.')
+	start = time.time()
+else:
+	print(f'One core is gathering columns to overwrite at time {dateval}.')
+	start = time.time()
+	wrapper = GT_Container(timestamp)
+	end = time.time()
+	print(f'Core gathered columns and ensemble in {end - start} seconds. Begin saving.')
+	start = time.time()
+	wrapper.reconstructAnalysisEnsemble()
 if DO_ADDL_INFLATION:
+	#Inflation needs every updated member at once, so update here and only parallelize saving.
+	wrapper.updateRestartsAndScalingFactors()
 	wrapper.performAdditionalInflation(timestamp_background)
-wrapper.saveRestartsAndScalingFactors()
+	wrapper.saveRestartsAndScalingFactors(nworkers=COMBINE_WRITE_WORKERS)
+else:
+	wrapper.updateAndSaveRestartsAndScalingFactors(nworkers=COMBINE_WRITE_WORKERS)
 
 if SaveDOFS:
 	npy_dofs_files = glob(f"{data['MY_PATH']}/{data['RUN_NAME']}/ensemble_runs/logs/dofs_scratch/*.npy")
@@ -0,0 +1,82 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+#Vectorized great circle distances on a spherical Earth. All inputs are in degrees, outputs in km.
+#These follow the same spherical law used by geopy's great_circle (arctan2 form, well conditioned at all distances),
+#so distances match the per-pair geopy calculation previously used across CHEEREIO.
+
+EARTH_RADIUS_km = 6371.009 #Mean earth radius, as in geopy
+
+#Great circle distance between (lat1,lon1) and (lat2,lon2). Inputs are broadcast against each other with numpy rules,
+#so any mix of scalars and arrays works (e.g. lat2[:,np.newaxis] and lon2[np.newaxis,:] for a whole grid).
+def greatCircleDistance_km(lat1,lon1,lat2,lon2):
+	lat1 = np.radians(lat1)
+	lon1 = np.radians(lon1)
+	lat2 = np.radians(lat2)
+	lon2 = np.radians(lon2)
+	sin_lat1 = np.sin(lat1)
+	cos_lat1 = np.cos(lat1)
+	sin_lat2 = np.sin(lat2)
+	cos_lat2 = np.cos(lat2)
+	delta_lon = lon2-lon1
+	cos_delta_lon = np.cos(delta_lon)
+	sin_delta_lon = np.sin(delta_lon)
+	numerator = np.sqrt((cos_lat2*sin_delta_lon)**2 + ((cos_lat1*sin_lat2)-(sin_lat1*cos_lat2*cos_delta_lon))**2)
+	denominator = (sin_lat1*sin_lat2)+(cos_lat1*cos_lat2*cos_delta_lon)
+	return EARTH_RADIUS_km*np.arctan2(numerator,denominator)
+
+#One-to-many: distances from a single point to a vector of points.
+def distToPoints_km(latval,lonval,lats,lons):
+	return greatCircleDistance_km(latval,lonval,np.asarray(lats),np.asarray(lons))
+
+#Many-to-many: distance matrix with shape (len(lats1),len(lats2)).
+def distMatrix_km(lats1,lons1,lats2,lons2):
+	lats1 = np.asarray(lats1)[:,np.newaxis]
+	lons1 = np.asarray(lons1)[:,np.newaxis]
+	lats2 = np.asarray(lats2)[np.newaxis,:]
+	lons2 = np.asarray(lons2)[np.newaxis,:]
+	return greatCircleDistance_km(lats1,lons1,lats2,lons2)
+
+#Many-to-many distance matrix between all pairs of points in lats/lons, computed in row blocks so that
+#temporary memory is bounded by blocksize x len(lats) regardless of the number of points.
+#out can be a preallocated array (e.g. a np.memmap for very large grids); otherwise one is allocated.
+def blockwiseDistMatrix_km(lats,lons,blocksize=1024,out=None,verbose=1):
+	lats = np.asarray(lats)
+	lons = np.asarray(lons)
+	numpoints = len(lats)
+	if out is None:
+		out = np.zeros((numpoints,numpoints))
+	for start in range(0,numpoints,blocksize):
+		end = min(start+blocksize,numpoints)
+		if verbose >= 1:
+			print(f'Calculating rows {start} to {end} of {numpoints}')
+		out[start:end,:] = distMatrix_km(lats[start:end],lons[start:end],lats,lons)
+	return out
+
+#Convert lat/lon in degrees to cartesian coordinates on the unit sphere.
+def latLonToUnitXYZ(lats,lons):
+	lats = np.radians(np.asarray(lats,dtype=float))
+	lons = np.radians(np.asarray(lons,dtype=float))
+	coslat = np.cos(lats)
+	return np.column_stack((coslat*np.cos(lons),coslat*np.sin(lons),np.sin(lats)))
+
+#KD-tree over a set of points (e.g. observations) on the unit sphere, built once and queried by great circle radius.
+#Great circle distance is monotonic in chord length, so a radius query is a ball query on the unit sphere.
+class SphericalPointIndex(object):
+	def __init__(self,lats,lons):
+		self.lats = np.asarray(lats,dtype=float)
+		self.lons = np.asarray(lons,dtype=float)
+		if len(self.lats)>0:
+			self.tree = cKDTree(latLonToUnitXYZ(self.lats,self.lons))
+		else:
+			self.tree = None
+	#Returns sorted indices of all points within radius_km of (latval,lonval), along with their great circle distances.
+	def queryRadius(self,latval,lonval,radius_km):
+		if self.tree is None:
+			return [np.array([],dtype=int),np.array([])]
+		chord = 2*np.sin(min(radius_km/(2*EARTH_RADIUS_km),np.pi/2))
+		candidates = self.tree.query_ball_point(latLonToUnitXYZ(latval,lonval)[0],chord*(1+1e-9)+1e-12) #Pad slightly; exact cut below
+		candidates = np.sort(np.array(candidates,dtype=int))
+		distances = distToPoints_km(latval,lonval,self.lats[candidates],self.lons[candidates])
+		valid = distances<=radius_km
+		return [candidates[valid],distances[valid]]
@@ -0,0 +1,87 @@
+import numpy as np
+import json
+import os
+import pathlib
+import time
+from os.path import isfile
+from GC_Translator import GC_Translator
+
+#On-disk cube of ensemble state vectors (ensemble member x state vector) for one assimilation window.
+#The first LETKF worker to claim the lock file reads every restart and scaling factor file once and writes the cube;
+#all other workers wait for it to finish and then attach to it read-only as a memory map, so the restarts are read
+#once per window rather than once per worker. Row i-1 holds ensemble member i, matching the LETKF convention.
+#The cube is in .npy format but saved with a .bin extension, so that it is not mistaken for other scratch files.
+
+def getEnsembleCubePath(spc_config):
+	return f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch/ensemble_cube"
+
+class EnsembleCube(object):
+	def __init__(self,path,timestamp,verbose=1):
+		self.path = path
+		self.timestamp = timestamp
+		self.verbose = verbose
+		self.cube_filename = f'{path}/statevec_cube_{timestamp}.bin'
+		self.meta_filename = f'{path}/statevec_cube_{timestamp}.json'
+		self.lock_filename = f'{path}/statevec_cube_{timestamp}.lock'
+		self.cube = None
+		self.ensemble_numbers = None
+	def isReady(self):
+		return isfile(self.meta_filename)
+	#Try to become the builder for this window. Creating the lock file is atomic, so exactly one worker succeeds.
+	def claimBuild(self):
+		pathlib.Path(self.path).mkdir(parents=True, exist_ok=True)
+		try:
+			fd = os.open(self.lock_filename,os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			return False
+		os.write(fd,f'{os.getpid()}\n'.encode())
+		os.close(fd)
+		return True
+	#Read each ensemble member once (one at a time, to bound memory) and write its state vector into the cube.
+	#directories is a dictionary of ensemble number to run directory, excluding the control (ensemble 0).
+	def build(self,directories,timestamp_for_gt):
+		ensemble_numbers = sorted(directories.keys())
+		cube = None
+		for ens in ensemble_numbers:
+			if self.verbose>=2:
+				print(f'Adding ensemble member {ens} to ensemble cube for {self.timestamp}.')
+			gt = GC_Translator(directories[ens], timestamp_for_gt, True,self.verbose)
+			statevec = gt.getStateVector()
+			gt.closeFiles()
+			if cube is None:
+				cube = np.lib.format.open_memmap(self.cube_filename,mode='w+',dtype=statevec.dtype,shape=(int(max(ensemble_numbers)),len(statevec)))
+			cube[ens-1,:] = statevec
+		cube.flush()
+		del cube
+		#Write metadata last, so that a partially written cube is never attached.
+		with open(self.meta_filename, 'w') as f:
+			json.dump({'ensemble_numbers':[int(ens) for ens in ensemble_numbers]}, f, indent = 6)
+	#Wait for the builder to finish. Stop waiting if the ensemble is killed (e.g. because the builder crashed).
+	def waitUntilReady(self,kill_filename,poll_seconds=2):
+		while not self.isReady():
+			if isfile(kill_filename):
+				raise RuntimeError(f'Ensemble killed while waiting for ensemble cube {self.cube_filename}.')
+			time.sleep(poll_seconds)
+	def attach(self):
+		with open(self.meta_filename) as f:
+			meta = json.load(f)
+		self.ensemble_numbers = np.array(meta['ensemble_numbers'])
+		self.cube = np.load(self.cube_filename,mmap_mode='r')
+		if self.verbose>=2:
+			print(f'Attached to ensemble cube {self.cube_filename} with dimension {np.shape(self.cube)}.')
+	#Build the cube if no other worker has claimed it, otherwise wait for it; then attach read-only.
+	def buildOrAttach(self,directories,timestamp_for_gt,kill_filename):
+		if not self.isReady():
+			if self.claimBuild():
+				start = time.time()
+				self.build(directories,timestamp_for_gt)
+				if self.verbose>=1:
+					print(f'Built ensemble cube for {self.timestamp} in {time.time()-start} seconds.')
+			else:
+				if self.verbose>=1:
+					print(f'Waiting for another worker to build ensemble cube for {self.timestamp}.')
+				self.waitUntilReady(kill_filename)
+		self.attach()
+	#Ensemble state vectors at the given state vector indices, with dimension (len(inds),number of ensemble members).
+	def getStateVectors(self,inds):
+		return np.transpose(self.cube[:,inds])
@@ -145,7 +145,7 @@ def saveNetCDF(scalefactor2D, stringnum, emis_name):
 			"End_Time":"0"
 		}
 	)
-	ds.to_netcdf(f"{outdir}/{name}.nc")
+	ds.to_netcdf(f"{outdir}/{name}.nc",unlimited_dims=['time'],encoding=si.getOutputEncoding(ds,'scalefactor',spc_config)) #Unlimited so that each assimilation window's scaling factors can be appended in place
 	print(f"Scaling factors \'{name}.nc\' in folder {spc_config['RUN_NAME']}_{stringnum} initialized successfully!")
 
 #subtract mean to avoid biased initial conditions (e.g. mean one), save out initial std for entire ensemble, save out scalefactors for each ensemble member
@@ -0,0 +1,90 @@
+import numpy as np
+import json
+import pathlib
+from os.path import isfile
+import settings_interface as si
+import distance_tools as dt
+
+#Precomputed localization index tables for the GEOS-Chem grid. For every grid cell, we store the flattened (lat,lon) indices of
+#all grid cells within the localization radius, in CSR form: the surroundings of cell c = latind*nlon+lonind are
+#indices[indptr[c]:indptr[c+1]] (sorted, matching the order of np.where on a lat x lon grid), and centre[c] is the position
+#of cell c within its own surroundings. Tables are made once at setup time by prep_par.py and are memory-mapped at assimilation time.
+
+def getLocalizationTablePath(spc_config):
+	return f"{spc_config['MY_PATH']}/{spc_config['RUN_NAME']}/scratch/localization"
+
+#Tables are in .npy format but saved with a .bin extension, so that they are not mistaken for other scratch files.
+def saveTable(filename,arr):
+	with open(filename,'wb') as f:
+		np.save(f,arr)
+
+#Compute the CSR tables for a lat/lon grid (in degrees) and localization radius (in km), and save them to path.
+#Only latitude rows that could possibly be within the radius are considered.
+def makeLocalizationTables(lat,lon,loc_rad,path,verbose=1):
+	pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+	lat = np.array(lat)
+	lon = np.array(lon)
+	nlat = len(lat)
+	nlon = len(lon)
+	max_dlat = np.degrees(loc_rad/dt.EARTH_RADIUS_km) #Latitude difference is a lower bound on great circle distance
+	counts = np.zeros(nlat*nlon,dtype=np.int64)
+	indices = []
+	centre = np.zeros(nlat*nlon,dtype=np.int32)
+	for i in range(nlat):
+		if verbose>=2:
+			print(f'Calculating localization tables for latitude row {i} of {nlat}')
+		rows = np.where(np.abs(lat-lat[i])<=max_dlat+1e-9)[0]
+		dist = dt.greatCircleDistance_km(lat[i],lon[:,np.newaxis,np.newaxis],lat[rows][np.newaxis,:,np.newaxis],lon[np.newaxis,np.newaxis,:]) #lon of centre, candidate lat rows, lon
+		for j in range(nlon):
+			rr,cc = np.where(dist[j,:,:]<=loc_rad)
+			flat = (rows[rr]*nlon)+cc
+			cell = (i*nlon)+j
+			counts[cell] = len(flat)
+			centre[cell] = np.searchsorted(flat,cell)
+			indices.append(flat.astype(np.int32))
+	indptr = np.zeros(nlat*nlon+1,dtype=np.int64)
+	indptr[1::] = np.cumsum(counts)
+	saveTable(f'{path}/localization_indptr.bin',indptr)
+	saveTable(f'{path}/localization_indices.bin',np.concatenate(indices))
+	saveTable(f'{path}/localization_centre.bin',centre)
+	#Write metadata last, so that a partially written table is never picked up.
+	with open(f'{path}/localization_meta.json', 'w') as f:
+		json.dump({'LOCALIZATION_RADIUS_km':float(loc_rad),'nlat':nlat,'nlon':nlon}, f, indent = 6)
+
+class LocalizationTable(object):
+	def __init__(self,path,nlat,nlon):
+		self.nlat = nlat
+		self.nlon = nlon
+		self.indptr = np.load(f'{path}/localization_indptr.bin',mmap_mode='r')
+		self.indices = np.load(f'{path}/localization_indices.bin',mmap_mode='r')
+		self.centre = np.load(f'{path}/localization_centre.bin',mmap_mode='r')
+	#Flattened (lat,lon) indices of all cells within the localization radius of latind,lonind.
+	def getSurroundings(self,latind,lonind):
+		cell = (latind*self.nlon)+lonind
+		return np.array(self.indices[self.indptr[cell]:self.indptr[cell+1]],dtype=np.int64)
+	#Position of latind,lonind within its own surroundings.
+	def getCentrePosition(self,latind,lonind):
+		return int(self.centre[(latind*self.nlon)+lonind])
+
+#One table per process, shared by every GC_Translator (and so by Assimilator and GT_Container).
+_table_cache = {}
+
+#Returns the memory-mapped table for the current ensemble, or None if no table matching the current grid and localization radius exists.
+def getLocalizationTable(spc_config=None,verbose=1):
+	if not spc_config:
+		spc_config = si.getSpeciesConfig()
+	path = getLocalizationTablePath(spc_config)
+	loc_rad = float(spc_config['LOCALIZATION_RADIUS_km'])
+	key = (path,loc_rad)
+	if key not in _table_cache:
+		table = None
+		if isfile(f'{path}/localization_meta.json'):
+			with open(f'{path}/localization_meta.json') as f:
+				meta = json.load(f)
+			lat,lon = si.getLatLonVals(spc_config)
+			if (meta['LOCALIZATION_RADIUS_km']==loc_rad) and (meta['nlat']==len(lat)) and (meta['nlon']==len(lon)):
+				table = LocalizationTable(path,meta['nlat'],meta['nlon'])
+			elif verbose>=1:
+				print(f'Localization tables in {path} do not match current grid and localization radius; computing localization on the fly.')
+		_table_cache[key] = table
+	return _table_cache[key]
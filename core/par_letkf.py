@@ -1,4 +1,5 @@
 from Assimilator import Assimilator
+from column_queue import ColumnQueue,getColumnQueuePath
 import sys
 import time
 import settings_interface as si 
@@ -9,6 +10,10 @@ data = si.getSpeciesConfig()
 path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
 timestamp = str(sys.argv[1]) #Time to assimilate. Expected in form YYYYMMDD_HHMM, UTC time.
 DO_RERUN = data["DO_VARON_RERUN"] == "True"
+USE_ENSEMBLE_CUBE = data["USE_SHARED_ENSEMBLE_CUBE"] == "True"
+LETKF_POOL_WORKERS = int(data["LETKF_POOL_WORKERS"]) #If greater than 0, core 1 handles the columns of all cores with a pool of this many workers.
+LETKF_POOL_TYPE = data["LETKF_POOL_TYPE"]
+DYNAMIC_COLUMN_SCHEDULING = data["DYNAMIC_COLUMN_SCHEDULING"] == "True" #If true, cores claim chunks of columns from a shared queue rather than a fixed list.
 if DO_RERUN:
 	number_of_windows_to_rerun = int(data["number_of_windows_to_rerun"])
 	do_approx = False
@@ -104,15 +109,23 @@ elif do_approx: #In this case, we just want to get trends from the history files
 else:
 	print(f'Core ({ensnum},{corenum}) is gathering ensemble at time {dateval}.')
 	start = time.time()
-	print(f'Assimilator call: Assimilator({timestamp},{ensnum},{corenum},timestamp_from_rip={timestamp_restart})')
+	use_cube = USE_ENSEMBLE_CUBE and (not do_amplification) #Amplification modifies every member's restart, so needs the full ensemble loaded.
+	print(f'Assimilator call: Assimilator({timestamp},{ensnum},{corenum},timestamp_from_rip={timestamp_restart},useEnsembleCube={use_cube})')
 	#a = Assimilator('20190108_0000',2,1)
-	a = Assimilator(timestamp,ensnum,corenum,timestamp_from_rip=timestamp_restart)
+	a = Assimilator(timestamp,ensnum,corenum,timestamp_from_rip=timestamp_restart,useEnsembleCube=use_cube)
 	end = time.time()
 	print(f'Core ({ensnum},{corenum}) gathered ensemble in {end - start} seconds. Begin {label_str} procedure.')
 	start = time.time()
 	if do_amplification:
 		a.amplifySpreads()
-	a.LETKF()
+	if DYNAMIC_COLUMN_SCHEDULING:
+		column_queue = ColumnQueue(getColumnQueuePath(data),timestamp,int(data["COLUMN_QUEUE_CHUNK_SIZE"]),int(data['verbose']))
+	else:
+		column_queue = None
+	if LETKF_POOL_WORKERS > 0:
+		a.poolLETKF(LETKF_POOL_WORKERS,LETKF_POOL_TYPE,column_queue)
+	else:
+		a.LETKF(column_queue)
 	end = time.time()
 	print(f'Core ({ensnum},{corenum}) completed computation for {dateval} and saved columns in {end - start} seconds.')
 
@@ -0,0 +1,164 @@
+import settings_interface as si
+import column_store as cs
+import numpy as np
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+from glob import glob
+from os.path import isfile
+
+#Waits in a single long-lived process for the ensemble to reach a phase transition, replacing one-second polling loops in
+#run_ensemble_simulations.sh that re-ran shell and Python checkers on every iteration. Usage:
+#	python phase_barrier.py CONDITION [CONDITION ...]
+#where each CONDITION is one of
+#	exists:FLAG       the signal file scratch/FLAG exists
+#	absent:FLAG       the signal file scratch/FLAG does not exist
+#	runs_complete     all ensemble runs have finished the current period; also writes ALL_RUNS_COMPLETE (ensemble member 1 only)
+#	columns_complete  all assimilated columns are saved (ensemble member 1 only)
+#Exits with code 0 as soon as any condition holds, or with code 1 if KILL_ENS appears.
+#On Linux, the relevant directories are watched with inotify so that local changes wake the barrier immediately. Other nodes' writes to a
+#shared file system do not raise inotify events, so conditions are also rechecked every POLL_SECONDS; these checks are cheap, in-process file tests.
+
+POLL_SECONDS = 1
+
+#inotify event masks, from sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+#Wakes when a file is created, deleted, renamed, or closed after writing in any of the directories, or after timeout seconds.
+#Falls back to sleeping for timeout seconds where inotify is unavailable.
+class DirectoryWatcher(object):
+	def __init__(self,directories):
+		self.fd = None
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+			fd = libc.inotify_init1(os.O_NONBLOCK)
+		except (OSError,AttributeError,TypeError):
+			return
+		if fd<0:
+			return
+		for directory in directories:
+			libc.inotify_add_watch(fd,os.fsencode(directory),WATCH_MASK) #A failed watch just means that directory is polled
+		self.fd = fd
+	def wait(self,timeout):
+		if self.fd is None:
+			time.sleep(timeout)
+			return
+		ready,_,_ = select.select([self.fd],[],[],timeout)
+		if ready:
+			try:
+				while os.read(self.fd,65536): #Drain queued events; the conditions are rechecked regardless of which event occurred
+					pass
+			except BlockingIOError:
+				pass
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+
+#In-process equivalent of check_for_all_restarts.sh (and check_for_all_runs_complete.py for run-in-place simulations).
+class RunsCompleteCondition(object):
+	def __init__(self,data,path_to_scratch):
+		self.path_to_scratch = path_to_scratch
+		path_to_ensemble = f"{data['MY_PATH']}/{data['RUN_NAME']}/ensemble_runs"
+		self.use_logs = data['DO_RUN_IN_PLACE'] == "True"
+		if self.use_logs:
+			subdirs = glob(f"{path_to_ensemble}/*/")
+			subdirs.remove(f"{path_to_ensemble}/logs/")
+			self.files_to_check = [f"{subdir}GC.log" for subdir in subdirs]
+		else:
+			with open(f"{path_to_scratch}/INPUT_GEOS_TEMP") as f:
+				lines = f.readlines()
+			end_timestamp = lines[-1].strip()[0:-2].replace(' ','_')
+			self.rst_filename = f"GEOSChem.Restart.{end_timestamp}z.nc4"
+			if (data['DO_CONTROL_RUN'] == "true") and (data['DO_CONTROL_WITHIN_ENSEMBLE_RUNS'] == "true"):
+				first = 0
+			else:
+				first = 1
+			self.files_to_check = [f"{path_to_ensemble}/{data['RUN_NAME']}_{str(x).zfill(4)}/{self.rst_filename}" for x in range(first,int(data['nEnsemble'])+1)]
+		self.directories = list(set([os.path.dirname(file) for file in self.files_to_check]))
+	def lastLineIsEnd(self,logfile):
+		if not isfile(logfile):
+			return False
+		with open(logfile,'rb') as f:
+			f.seek(0,os.SEEK_END)
+			f.seek(max(f.tell()-4096,0))
+			lines = f.read().decode(errors='ignore').splitlines()
+		return (len(lines)>0) and lines[-1].startswith('**************   E N D')
+	def check(self):
+		if self.use_logs:
+			done = np.all([self.lastLineIsEnd(file) for file in self.files_to_check])
+		else:
+			done = np.all([isfile(file) for file in self.files_to_check])
+		if done:
+			with open(f"{self.path_to_scratch}/ALL_RUNS_COMPLETE", "w") as f:
+				if self.use_logs:
+					f.write("All ensemble runs are complete according to their log file.\n")
+				else:
+					f.write(f"All ensemble folders contain file {self.rst_filename}.\n")
+				f.write("Proceeding to data assimilation phase.\n")
+				f.write("done\n")
+		return done
+
+#In-process equivalent of check_for_all_columns.py. Each container's index is only read once.
+class ColumnsCompleteCondition(object):
+	def __init__(self,data,path_to_scratch):
+		self.path_to_scratch = path_to_scratch
+		latgrid,longrid = si.getLatLonVals(data)
+		self.num_cells = len(latgrid)*len(longrid)
+		self.counts = {}
+		self.directories = [d for d in glob(f"{path_to_scratch}/*/*/")]
+	def check(self):
+		for prefix in cs.getColumnContainerPrefixes(self.path_to_scratch):
+			if prefix not in self.counts:
+				self.counts[prefix] = len(cs.ColumnContainer(prefix))
+		return np.sum(list(self.counts.values()))==self.num_cells
+
+class FlagCondition(object):
+	def __init__(self,path_to_scratch,flag,exists):
+		self.filename = f"{path_to_scratch}/{flag}"
+		self.exists = exists
+		self.directories = []
+	def check(self):
+		return isfile(self.filename) == self.exists
+
+def makeCondition(data,path_to_scratch,condition):
+	if condition == 'runs_complete':
+		return RunsCompleteCondition(data,path_to_scratch)
+	elif condition == 'columns_complete':
+		return ColumnsCompleteCondition(data,path_to_scratch)
+	elif condition.startswith('exists:'):
+		return FlagCondition(path_to_scratch,condition.split(':')[1],True)
+	elif condition.startswith('absent:'):
+		return FlagCondition(path_to_scratch,condition.split(':')[1],False)
+	else:
+		raise ValueError(f"Phase barrier condition '{condition}' not recognized.")
+
+#Returns 0 when any condition holds, or 1 if the ensemble is killed first.
+def waitForPhase(conditions,path_to_scratch):
+	directories = [path_to_scratch]
+	for condition in conditions:
+		directories.extend(condition.directories)
+	watcher = DirectoryWatcher(directories)
+	try:
+		while True:
+			if isfile(f"{path_to_scratch}/KILL_ENS"):
+				return 1
+			if np.any([condition.check() for condition in conditions]):
+				return 0
+			watcher.wait(POLL_SECONDS)
+	finally:
+		watcher.close()
+
+if __name__ == '__main__':
+	data = si.getSpeciesConfig()
+	path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
+	conditions = [makeCondition(data,path_to_scratch,condition) for condition in sys.argv[1:]]
+	sys.exit(waitForPhase(conditions,path_to_scratch))
@@ -0,0 +1,12 @@
+#!/bin/bash
+eval "$(conda shell.bash hook)"
+
+#Wait for a phase transition (see phase_barrier.py for the conditions that can be passed). Exits with the Python exit code:
+#0 once a condition holds, nonzero if the ensemble is killed or the barrier fails, in which case the caller falls back to polling.
+CONDA_ENV=$(jq -r ".CondaEnv" ../ens_config.json)
+
+source activate ${CONDA_ENV} #Activate conda environment.
+python -u phase_barrier.py "$@"
+py_exit_status=$?
+conda deactivate #Exit Conda environment
+exit $py_exit_status
@@ -1,4 +1,6 @@
 import settings_interface as si 
+import localization_tools as lt
+import column_partitioning as cp
 import json
 import numpy as np
 import xarray as xr
@@ -23,53 +25,17 @@ lat = np.array(rst_dataset['lat'])
 lat_inds = np.arange(0,len(lat))
 lon = np.array(rst_dataset['lon'])
 lon_inds = np.arange(0,len(lon))
+nlev = len(rst_dataset['lev'])
 
 #Save out lat/lon for quick reading later
-latlon_dict = {'lat':lat.tolist(), 'lon':lon.tolist()}
+latlon_dict = {'lat':lat.tolist(), 'lon':lon.tolist(), 'nlev':nlev}
 out_file = open(f"{path_to_sim}scratch/latlon_vals.json", "w")
 json.dump(latlon_dict, out_file, indent = 6)
 out_file.close()
 
-lat_full_list = np.repeat(lat_inds,len(lon))
-lon_full_list = np.tile(lon_inds,len(lat))
-total_cells = len(lat)*len(lon)
-nens = int(data['nEnsemble'])
-min_cells = np.floor(total_cells/nens)
-remainder_cells = total_cells%nens
-column_count_array = np.repeat(min_cells,nens)
-column_count_array[0:remainder_cells] = min_cells+1
-array_endpoints = np.insert(np.cumsum(column_count_array),0,0)
-split_lat_inds = []
-split_lon_inds = []
+#Precompute which grid cells fall within the localization radius of every other grid cell
+lt.makeLocalizationTables(lat,lon,float(data['LOCALIZATION_RADIUS_km']),lt.getLocalizationTablePath(data),verbose=int(data['verbose']))
 
-for i in range(len(array_endpoints)-1):
-	startpoint = int(array_endpoints[i])
-	endpoint = int(array_endpoints[i+1])
-	split_lat_inds.append(lat_full_list[startpoint:endpoint])
-	split_lon_inds.append(lon_full_list[startpoint:endpoint])
-
-ncore = int(data['MaxPar'])
-
-dict_to_save = {}
-for i in range(len(subdir_numbers)):
-	latlist = split_lat_inds[i]
-	lonlist = split_lon_inds[i]
-	#Split further by cores
-	min_subcells = np.floor(len(latlist)/ncore)
-	remainder_subcells = len(latlist)%ncore
-	subcolumn_count_array = np.repeat(min_subcells,ncore)
-	subcolumn_count_array[0:remainder_subcells] = min_subcells+1
-	subarray_endpoints = np.insert(np.cumsum(subcolumn_count_array),0,0)
-	subdirstring = str(i+1).zfill(3)
-	subdict = {}
-	for j in range(ncore):
-		startpoint = int(subarray_endpoints[j])
-		endpoint = int(subarray_endpoints[j+1])
-		corestring = str(j+1).zfill(3)
-		pathlib.Path(f"{path_to_sim}scratch/{subdirstring}/{corestring}").mkdir(parents=True, exist_ok=True) 
-		subdict[j+1] = {'lat':latlist[startpoint:endpoint].tolist(),'lon':lonlist[startpoint:endpoint].tolist()}
-	dict_to_save[i+1] = subdict
-
-out_file = open(f"{path_to_sim}scratch/latlon_par.json", "w")
-json.dump(dict_to_save, out_file, indent = 6)
-out_file.close()
\ No newline at end of file
+#Split columns among ensemble members and cores. No observations exist yet at setup, so this is an even split by count;
+#if COST_AWARE_COLUMN_PARTITIONING is on, the split is redone by estimated cost after each assimilation (see repartition_columns.py).
+cp.makeColumnPartition(data,lat,lon,nlev,verbose=int(data['verbose']))
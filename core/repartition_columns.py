@@ -0,0 +1,24 @@
+import settings_interface as si 
+import column_partitioning as cp
+import json
+import sys
+import xarray as xr
+
+#Redo the split of columns among ensemble members and cores for the next assimilation window,
+#balancing estimated LETKF cost using the observations from the window just assimilated.
+
+timestamp = str(sys.argv[1]) #Time just assimilated. Expected in form YYYYMMDD_HHMM, UTC time.
+
+data = si.getSpeciesConfig()
+verbose = int(data['verbose'])
+
+if data['COST_AWARE_COLUMN_PARTITIONING'] == "True":
+	path_to_scratch = f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch"
+	with open(f"{path_to_scratch}/latlon_vals.json") as f:
+		latlon = json.load(f)
+	if 'nlev' in latlon:
+		nlev = latlon['nlev']
+	else: #Older ensembles did not save the number of levels, so read it from the initial restart as prep_par.py does
+		with xr.open_dataset(data['RESTART_FILE']) as rst_dataset:
+			nlev = len(rst_dataset['lev'])
+	cp.makeColumnPartition(data,latlon['lat'],latlon['lon'],nlev,timestamp=timestamp,verbose=verbose)
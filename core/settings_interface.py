@@ -40,11 +40,17 @@ def importObsTranslators(return_obsop_list = False):
 	else:
 		return result
 
-#Get the latitude and longitude list for a particular core (indexed by ensemble and core)
-def getLatLonList(ensnum,corenum):
-	data = getSpeciesConfig()
+#Get the full split of columns among ensemble members and cores
+def getLatLonPar(data=None):
+	if not data:
+		data = getSpeciesConfig()
 	with open(f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch/latlon_par.json") as f:
 		gridsplit = json.load(f)
+	return gridsplit
+
+#Get the latitude and longitude list for a particular core (indexed by ensemble and core)
+def getLatLonList(ensnum,corenum):
+	gridsplit = getLatLonPar()
 	return [gridsplit[f'{ensnum}'][f'{corenum}']['lat'],gridsplit[f'{ensnum}'][f'{corenum}']['lon']]
 
 #Get the lat lon values for the grid from the JSON
@@ -54,3 +60,20 @@ def getLatLonVals(data=None):
 	with open(f"{data['MY_PATH']}/{data['RUN_NAME']}/scratch/latlon_vals.json") as f:
 		ll_data = json.load(f)
 	return [ll_data['lat'],ll_data['lon']]
+
+#Get the to_netcdf encoding for dataset ds from the OUTPUT_ENCODING settings for filetype (restart, scalefactor, or postprocess).
+#Data variables are compressed with zlib if requested, and chunked so that the dimensions listed in chunks are kept whole and all
+#other dimensions have chunk size 1, matching how the next reader uses the file. The dtype and fill value of each variable are kept.
+def getOutputEncoding(ds,filetype,data=None):
+	if not data:
+		data = getSpeciesConfig()
+	policy = data['OUTPUT_ENCODING'][filetype]
+	whole_dims = [dim.strip() for dim in policy['chunks'].split(',') if dim.strip() != '']
+	encoding = {}
+	for name in ds.data_vars:
+		variable = ds[name]
+		encoding[name] = {key:val for key,val in variable.encoding.items() if key in ['dtype','_FillValue','scale_factor','add_offset']}
+		encoding[name].update({'zlib':policy['zlib'] == "True",'complevel':int(policy['complevel']),'shuffle':policy['shuffle'] == "True"})
+		if (len(whole_dims)>0) and (len(variable.dims)>0):
+			encoding[name]['chunksizes'] = tuple([variable.sizes[dim] if dim in whole_dims else 1 for dim in variable.dims])
+	return encoding
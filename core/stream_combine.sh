@@ -0,0 +1,23 @@
+#!/bin/bash
+eval "$(conda shell.bash hook)"
+
+#Run in the background by ensemble member 1 while the LETKF runs. Loads the ensemble, combines each LETKF core's columns as soon as
+#they are saved, and overwrites restarts and scaling factors once the last columns arrive.
+MY_PATH="$(jq -r ".MY_PATH" ../ens_config.json)"
+RUN_NAME="$(jq -r ".RUN_NAME" ../ens_config.json)"
+CONDA_ENV=$(jq -r ".CondaEnv" ../ens_config.json)
+
+end_timestamp="$(tail -n 1 ${MY_PATH}/${RUN_NAME}/scratch/INPUT_GEOS_TEMP)"
+end_timestamp="${end_timestamp%??}" #Clear last two characters
+end_timestamp="${end_timestamp// /_}" #Replace space with underscore
+
+source activate ${CONDA_ENV} #Activate conda environment.
+python -u combine_columns_and_update.py ${end_timestamp} stream >> ${MY_PATH}/${RUN_NAME}/ensemble_runs/logs/letkf_master.out
+py_exit_status=$?
+if [ $py_exit_status = 0 ]; then
+	python -u repartition_columns.py ${end_timestamp} >> ${MY_PATH}/${RUN_NAME}/ensemble_runs/logs/letkf_master.out #Rebalance columns across cores for the next window; falls back to the existing split on failure.
+	echo 'Done' > ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE
+elif [ $py_exit_status != 3 ]; then #Exit code 3 means there was nothing to combine this window.
+	printf "Python streaming combine script exited without code 0 \n" > ${MY_PATH}/${RUN_NAME}/scratch/KILL_ENS #This file's presence will break loop
+fi
+conda deactivate #Exit Conda environment
@@ -180,12 +180,14 @@ def walkThroughAssimilation(assim,latind=65,lonind=24): #default is a point in n
 	print(f'ybar has value {assim.ybar_background}')
 	print(f'ydiff has value {assim.ydiff}')
 	assim.makeR(latind,lonind)
-	sqrtdiag = np.sqrt(np.diag(assim.R))
+	if np.ndim(assim.R)==1:
+		sqrtdiag = np.sqrt(assim.R)
+	else:
+		sqrtdiag = np.sqrt(np.diag(assim.R))
 	print(f'The square root of the diagonal of R is {sqrtdiag}')
 	print(f'Relative to ybar, that diagonal is value {sqrtdiag/assim.ybar_background}')
 	assim.makeC()
-	assim.makePtildeAnalysis()
-	assim.makeWAnalysis()
+	assim.makePtildeAndWAnalysis()
 	assim.makeWbarAnalysis()
 	assim.adjWAnalysis()
 	assim.makeAnalysisCombinedEnsemble()
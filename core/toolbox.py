@@ -1,16 +1,13 @@
-import geopy.distance as gd
 import numpy as np
 import scipy.stats as ss
 import scipy.signal
 from settings_interface import *
+import distance_tools as dt
 
 
 #Inputs are in degrees
 def calcDist_km(lat1,lon1,lat2,lon2):
-	coords_1 = (lat1,lon1)
-	coords_2 = (lat2,lon2)
-	d = gd.great_circle(coords_1, coords_2).km #This approximation is fine.
-	return d
+	return dt.greatCircleDistance_km(lat1,lon1,lat2,lon2) #Great circle approximation is fine; works on arrays too.
 
 def makeLatLonGridWithMask(gridlabel,mask_coast_bool="True"):
 	mask = None
@@ -93,22 +90,14 @@ def makeLatLonGridWithMask(gridlabel,mask_coast_bool="True"):
 def makeDistMat(instruction = 'file', verbose = 1, makeDistMat = True):
 	#In this case, use the saved lat/lon data in the scratch folder
 	if instruction == 'file':
-		lat,lon = getLatLonVals(data)
+		lat,lon = getLatLonVals(getSpeciesConfig())
 	#Otherwise, generate the lat lon data according to the supplied gridlabel
 	else:
 		lon,lat,_ = makeLatLonGridWithMask(instruction)
 	X,Y = np.meshgrid(lon,lat)
 	XY = np.column_stack((np.ndarray.flatten(X),np.ndarray.flatten(Y)))
 	if makeDistMat:
-		numpoints = np.shape(XY)[0]
-		distmat = np.zeros((numpoints,numpoints))
-		for i in range(numpoints):
-			if verbose >= 1:
-				print(f'Calculating row {i} of {numpoints}')
-			for j in range(i, numpoints):
-				distval = calcDist_km(XY[i,1],XY[i,0],XY[j,1],XY[j,0])
-				distmat[i,j] = distval
-				distmat[j,i] = distval
+		distmat = dt.blockwiseDistMatrix_km(XY[:,1],XY[:,0],verbose=verbose)
 		return [distmat,XY]
 	#Option to just get lon/lat coordinates from distmat file
 	else:
@@ -159,10 +148,7 @@ def getIndsOfInterest(latind,lonind,negate=False,return_dist=False):
 	latval = lat[latind]
 	lonval = lon[lonind]
 	loc_rad = float(data['LOCALIZATION_RADIUS_km'])
-	distgrid = np.zeros((len(lat),len(lon)))
-	for i in range(len(lon)):
-		dists_col = np.array([calcDist_km(latval,lonval,a,lon[i]) for a in lat])
-		distgrid[:,i] = dists_col
+	distgrid = dt.greatCircleDistance_km(latval,lonval,np.array(lat)[:,np.newaxis],np.array(lon)[np.newaxis,:])
 	if negate:
 		valid_inds = np.where(distgrid>loc_rad)
 	else:
@@ -52,7 +52,15 @@ upper_case_booleans = ["SaveLevelEdgeDiags",
 "DO_RUN_IN_PLACE",
 "DIFFERENT_RUN_IN_PLACE_FOR_BURN_IN",
 "DO_VARON_RERUN",
-"useLogScaleForEmissionsMaps"]
+"useLogScaleForEmissionsMaps",
+"BATCH_LETKF",
+"USE_DENSE_OBS_ERROR_COVARIANCE",
+"USE_SHARED_ENSEMBLE_CUBE",
+"USE_BIGY_CACHE",
+"COST_AWARE_COLUMN_PARTITIONING",
+"DYNAMIC_COLUMN_SCHEDULING",
+"STREAMING_COMBINE",
+"EVENT_DRIVEN_PHASE_BARRIERS"]
 
 for b in upper_case_booleans:
 	val = spc_config[b]
@@ -76,6 +84,41 @@ for b in upper_case_boolean_dicts:
 		if val not in ['True','False']:
 			raise ValueError(f'Setting {b} must have True or False (case sensitive) for all values; current value for key {key} within {b} is {val}.')
 
+############################################################
+####################CHECK LETKF SETTINGS####################
+############################################################
+
+if spc_config['LETKF_WEIGHT_KERNEL'] not in ['eigh','sqrtm']:
+	raise ValueError(f"Setting LETKF_WEIGHT_KERNEL must be eigh or sqrtm; current value is {spc_config['LETKF_WEIGHT_KERNEL']}.")
+
+if spc_config['LETKF_POOL_TYPE'] not in ['process','thread']:
+	raise ValueError(f"Setting LETKF_POOL_TYPE must be process or thread; current value is {spc_config['LETKF_POOL_TYPE']}.")
+
+if (not spc_config['LETKF_POOL_WORKERS'].isdigit()):
+	raise ValueError(f"Setting LETKF_POOL_WORKERS must be a non-negative integer; current value is {spc_config['LETKF_POOL_WORKERS']}.")
+
+if (not spc_config['COLUMN_QUEUE_CHUNK_SIZE'].isdigit()) or (int(spc_config['COLUMN_QUEUE_CHUNK_SIZE'])<1):
+	raise ValueError(f"Setting COLUMN_QUEUE_CHUNK_SIZE must be a positive integer; current value is {spc_config['COLUMN_QUEUE_CHUNK_SIZE']}.")
+
+if not spc_config['COMBINE_WRITE_WORKERS'].isdigit():
+	raise ValueError(f"Setting COMBINE_WRITE_WORKERS must be a non-negative integer; current value is {spc_config['COMBINE_WRITE_WORKERS']}.")
+
+for filetype in ['restart','scalefactor','postprocess']:
+	policy = spc_config['OUTPUT_ENCODING'][filetype]
+	for key in ['zlib','shuffle']:
+		if policy[key] not in ['True','False']:
+			raise ValueError(f"Setting {key} for {filetype} in OUTPUT_ENCODING must be True or False (case sensitive); current value is {policy[key]}.")
+	if (not policy['complevel'].isdigit()) or (int(policy['complevel'])>9):
+		raise ValueError(f"Setting complevel for {filetype} in OUTPUT_ENCODING must be an integer from 0 to 9; current value is {policy['complevel']}.")
+	if (policy['zlib'] == "True") and (int(policy['complevel'])<1):
+		raise ValueError(f"Setting complevel for {filetype} in OUTPUT_ENCODING must be from 1 to 9 when zlib is True; current value is {policy['complevel']}.")
+
+if (not spc_config['BATCH_LETKF_SIZE'].isdigit()) or (int(spc_config['BATCH_LETKF_SIZE'])<1):
+	raise ValueError(f"Setting BATCH_LETKF_SIZE must be a positive integer; current value is {spc_config['BATCH_LETKF_SIZE']}.")
+
+if (spc_config["BATCH_LETKF"] == "True") and (spc_config["USE_DENSE_OBS_ERROR_COVARIANCE"] == "True"):
+	raise ValueError('Batched LETKF requires a diagonal observational error covariance. Set one or both of BATCH_LETKF and USE_DENSE_OBS_ERROR_COVARIANCE to False.')
+
 ############################################################
 ###############CHECK RUN-IN-PLACE SETTINGS##################
 ############################################################
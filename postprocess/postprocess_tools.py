@@ -77,9 +77,9 @@ def combineScaleFactors(ensemble_dir,output_dir,timeperiod=None,flag_snapshot=Fa
 			to_return[name] = ds
 		else:
 			if flag_snapshot:
-				ds.to_netcdf(output_dir+'/SNAPSHOT_'+name)
+				ds.to_netcdf(output_dir+'/SNAPSHOT_'+name,encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 			else:
-				ds.to_netcdf(output_dir+'/'+name)
+				ds.to_netcdf(output_dir+'/'+name,encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 	if return_not_write:
 		return to_return
 
@@ -97,7 +97,7 @@ def combineHemcoDiag(ensemble_dir,output_dir,timeperiod=None):
 	ds.assign_coords({'Ensemble':np.array(subdir_numbers)})
 	if timeperiod is not None:
 		ds = ds.sel(time=slice(timeperiod[0], timeperiod[1]))
-	ds.to_netcdf(output_dir+'/combined_HEMCO_diagnostics.nc')
+	ds.to_netcdf(output_dir+'/combined_HEMCO_diagnostics.nc',encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 
 def combineHemcoDiagControl(control_dir,output_dir,timeperiod=None):
 	paths = glob(f'{control_dir}/OutputDir/HEMCO_diagnostics.*.nc')
@@ -108,7 +108,7 @@ def combineHemcoDiagControl(control_dir,output_dir,timeperiod=None):
 	ds = xr.concat(ds_files,'time')
 	if timeperiod is not None:
 		ds = ds.sel(time=slice(timeperiod[0], timeperiod[1]))
-	ds.to_netcdf(output_dir+'/control_HEMCO_diagnostics.nc')
+	ds.to_netcdf(output_dir+'/control_HEMCO_diagnostics.nc',encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 
 
 def makeDatasetForDirectory(hist_dir,species_names,timeperiod=None,hourlysub = 6,subset_rule = 'SURFACE', fullpath_output_name = None):
@@ -123,7 +123,7 @@ def makeDatasetForDirectory(hist_dir,species_names,timeperiod=None,hourlysub = 6
 	elif subset_rule=='ALL':
 		pass
 	if fullpath_output_name:
-		ds.to_netcdf(fullpath_output_name)
+		ds.to_netcdf(fullpath_output_name,encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 	return ds
 
 def makeDatasetForEnsemble(ensemble_dir,species_names,timeperiod=None,hourlysub = 6,subset_rule = 'SURFACE',fullpath_output_name = None):
@@ -135,7 +135,7 @@ def makeDatasetForEnsemble(ensemble_dir,species_names,timeperiod=None,hourlysub
 	ds = xr.concat(array_list,'Ensemble')
 	ds.assign_coords({'Ensemble':np.array(subdir_numbers)})
 	if fullpath_output_name:
-		ds.to_netcdf(fullpath_output_name)
+		ds.to_netcdf(fullpath_output_name,encoding=si.getOutputEncoding(ds,'postprocess',spc_config))
 	return ds
 
 def getArea(ensemble_dir,pp_dir):
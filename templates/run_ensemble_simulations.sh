@@ -40,6 +40,10 @@ trigger_burnin_scale=false
 doburnin="$(jq -r ".DO_BURN_IN" {ASSIM}/ens_config.json)"
 scaleburnin="$(jq -r ".SIMPLE_SCALE_AT_END_OF_BURN_IN_PERIOD" {ASSIM}/ens_config.json)"
 amplifyspread="$(jq -r ".AMPLIFY_ENSEMBLE_SPREAD_FOR_FIRST_ASSIM_PERIOD" {ASSIM}/ens_config.json)"
+usebigycache="$(jq -r ".USE_BIGY_CACHE" {ASSIM}/ens_config.json)"
+letkfpoolworkers="$(jq -r ".LETKF_POOL_WORKERS" {ASSIM}/ens_config.json)"
+streamingcombine="$(jq -r ".STREAMING_COMBINE" {ASSIM}/ens_config.json)"
+eventbarriers="$(jq -r ".EVENT_DRIVEN_PHASE_BARRIERS" {ASSIM}/ens_config.json)"
 
 ### Run GEOS-Chem in the directory corresponding to the cluster Id
 cd  {RunName}_${xstr}
@@ -69,6 +73,14 @@ while [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ENSEMBLE_COMPLETE ]; do
   if [ $x -eq 1 ]; then
     cd {ASSIM}/core
   fi
+  #Wait in one process for ALL_RUNS_COMPLETE (which ensemble member 1 writes once all runs finish). The polling loop below is the fallback.
+  if [ "${eventbarriers}" = "True" ]; then
+    if [ $x -eq 1 ]; then
+      (cd {ASSIM}/core && bash phase_barrier.sh runs_complete exists:ALL_RUNS_COMPLETE)
+    else
+      (cd {ASSIM}/core && bash phase_barrier.sh exists:ALL_RUNS_COMPLETE)
+    fi
+  fi
   #Hang until ALL_RUNS_COMPLETE found in scratch folder
   until [ -f ${MY_PATH}/${RUN_NAME}/scratch/ALL_RUNS_COMPLETE ]
   do
@@ -84,6 +96,10 @@ while [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ENSEMBLE_COMPLETE ]; do
   done
   #CD to core
   cd {ASSIM}/core
+  #Ensemble member 1 builds the observation-space ensemble (BigY) once for all LETKF workers, which wait for it.
+  if [ $x -eq 1 ] && [ "${usebigycache}" = "True" ]; then
+    bash build_bigy.sh
+  fi
   #check if we are in the first assimilation cycle
   if [ -f ${MY_PATH}/${RUN_NAME}/scratch/IS_FIRST ]; then
     firstrun=true
@@ -108,14 +124,26 @@ while [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ENSEMBLE_COMPLETE ]; do
   else
     doamplification=false
   fi
-  #Use GNU parallel to submit parallel sruns, except nature
+  #With a streaming combine, ensemble member 1 combines columns in the background as LETKF cores finish, rather than after the slowest core.
+  if [ $x -eq 1 ] && [ "${streamingcombine}" = "True" ] && [ "${simplescale}" = "false" ]; then
+    bash stream_combine.sh &
+  fi
+  #Use GNU parallel to submit parallel sruns, except nature. With an LETKF pool, one process handles all cores' columns.
   if [ $x -ne 0 ]; then
-    if [ {MaxPar} -eq 1 ]; then
+    if [ {MaxPar} -eq 1 ] || [ ${letkfpoolworkers} -gt 0 ]; then
       bash par_assim.sh ${x} 1 ${firstrun} ${simplescale} ${doamplification}
     else
       parallel -j {MaxPar} "bash par_assim.sh ${x} {1} ${firstrun} ${simplescale} ${doamplification}" ::: {1..{MaxPar}}
     fi 
   fi
+  #Wait in one process until assimilation completes or cleanup completes; ensemble member 1 also wakes once all columns are saved, to combine them below.
+  if [ "${eventbarriers}" = "True" ]; then
+    if [ $x -eq 1 ] && [ "${simplescale}" = "false" ] && [ "${streamingcombine}" != "True" ]; then
+      bash phase_barrier.sh columns_complete exists:ASSIMILATION_COMPLETE absent:ALL_RUNS_COMPLETE
+    else
+      bash phase_barrier.sh exists:ASSIMILATION_COMPLETE absent:ALL_RUNS_COMPLETE
+    fi
+  fi
   #Hang until assimilation completes or cleanup completes (in case things go too quickly)
   until [ -f ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE ] || [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ALL_RUNS_COMPLETE ]; do
     #If this is ensemble member 1, check if assimilation is complete; if it is, do the final overwrites.
@@ -167,6 +195,9 @@ while [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ENSEMBLE_COMPLETE ]; do
     rm ${MY_PATH}/${RUN_NAME}/scratch/IS_FIRST
   fi
   #Hang until cleanup complete, as determined by temp file deletion.
+  if [ "${eventbarriers}" = "True" ]; then
+    bash phase_barrier.sh absent:ASSIMILATION_COMPLETE
+  fi
   until [ ! -f ${MY_PATH}/${RUN_NAME}/scratch/ASSIMILATION_COMPLETE ]; do
     #If there is a problem, the KILL_ENS file will be produced. Break then
     if [ -f ${MY_PATH}/${RUN_NAME}/scratch/KILL_ENS ]; then
@@ -6,7 +6,11 @@ import json
 import scipy.linalg as la
 sys.path.append('../core/')
 from Assimilator import Assimilator
+import column_partitioning as cp
+from column_queue import ColumnQueue
+import column_store as cs
 import testing_tools
+import settings_interface as si
 
 #Just test the LETKF math -- don't bother with making sure everything else loads right
 #This test also implicitly makes sure that assimilator constructor works.
@@ -24,6 +28,127 @@ def test_LETKF_calculation():
 		real_answer[:,i] = (assim.Xpert_background@w) + assim.xbar_background
 	assert np.allclose(assim_answer,real_answer)
 
+#Check that carrying R as a vector of variances gives the same C as inverting the dense diagonal matrix.
+def test_diagonal_R_matches_dense():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	k = len(assim.ensemble_numbers)
+	assim.Ypert_background = np.random.randn(12,k)
+	rvec = np.random.rand(12)+1
+	assim.R = np.diag(rvec)
+	assim.makeC()
+	denseC = np.copy(assim.C)
+	assim.R = rvec
+	assim.makeC()
+	assert np.allclose(denseC,assim.C)
+
+#Check that the eigendecomposition kernel for the analysis weights matches the original inverse + sqrtm kernel.
+def test_eigh_weight_kernel_matches_sqrtm():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	assim.inflation = 0.03
+	k = len(assim.ensemble_numbers)
+	assim.Ypert_background = np.random.randn(12,k)
+	assim.ydiff = np.random.randn(12)
+	assim.R = np.diag(np.random.rand(12)+1)
+	assim.makeC()
+	assim.WeightKernel = 'sqrtm'
+	assim.makePtildeAndWAnalysis()
+	sqrtm_Ptilde,sqrtm_W = np.copy(assim.PtildeAnalysis),np.copy(assim.WAnalysis)
+	assim.WeightKernel = 'eigh'
+	assim.makePtildeAndWAnalysis()
+	assert np.allclose(sqrtm_Ptilde,assim.PtildeAnalysis) and np.allclose(sqrtm_W,assim.WAnalysis)
+
+#Check that the Y-space and R-space calculations see the same observations for a column, even when observations are randomly subsampled.
+def test_local_obs_shared_by_Y_and_R():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	histens = assim.histens
+	histens.maxobs = 2
+	histens.localObs = None
+	latind,lonind = 65,24
+	ybar,Ypert,ydiff = histens.getLocObsMeanPertDiff(latind,lonind)
+	R = histens.makeRVector(latind,lonind)
+	localobs = histens.getLocalObs(latind,lonind)
+	obs = np.concatenate([histens.bigYDict[spec].getCols()[1][localobs.inds[spec]] for spec in localobs.species])
+	errvar = np.concatenate([histens.calcObsErrorVariance(spec,localobs.inds[spec],localobs.weights[spec]) for spec in localobs.species])
+	assert (len(R)==len(ydiff)) and np.allclose(ybar+ydiff,obs) and np.allclose(R,errvar)
+
+#Check that gathering from the window-level observation-space statistics matches computing them from the local subset.
+def test_window_obs_stats_match_local():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	histens = assim.histens
+	latind,lonind = 65,24
+	localobs = histens.getLocalObs(latind,lonind)
+	means,perts,diffs = [],[],[]
+	for spec in localobs.species:
+		gccol,obscol = histens.bigYDict[spec].getCols()
+		gccol = gccol[localobs.inds[spec],:]
+		obsmean = np.mean(gccol,axis=1)
+		means.append(obsmean)
+		perts.append(gccol-obsmean[:,np.newaxis])
+		diffs.append(obscol[localobs.inds[spec]]-obsmean)
+	assert np.allclose(localobs.ybar,np.concatenate(means)) and np.allclose(localobs.Ypert,np.concatenate(perts,axis=0)) and np.allclose(localobs.ydiff,np.concatenate(diffs))
+
+#Check that the ensemble space DOFS calculation matches the state space calculation with the pseudoinverse of the prior.
+def test_ensemble_space_DOFS_matches_state_space():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	k = len(assim.ensemble_numbers)
+	backgroundPert = np.random.randn(20,k)
+	backgroundPert -= np.mean(backgroundPert,axis=1)[:,np.newaxis]
+	W = np.identity(k)+(0.3*np.random.randn(k,k))
+	analysisPert = backgroundPert@W
+	assert np.isclose(assim.calculateDOFS(analysisPert,backgroundPert),assim.calculateDOFSStateSpace(analysisPert,backgroundPert))
+
+#Check that BigY survives a round trip through the scratch cache shared by LETKF workers.
+def test_bigy_cache_round_trip(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	histens = assim.histens
+	histens.getBigYCacheFilename = lambda: str(tmp_path/'bigy_cache.npz')
+	histens.saveBigYCache()
+	loaded = histens.loadBigYCache()
+	for species in histens.bigYDict:
+		gccol,obscol = histens.bigYDict[species].getCols()
+		loaded_gccol,loaded_obscol = loaded[species].getCols()
+		assert np.allclose(gccol,loaded_gccol) and np.allclose(obscol,loaded_obscol)
+		assert np.allclose(histens.bigYDict[species].getLatLon(),loaded[species].getLatLon())
+		assert set(histens.bigYDict[species].additional_data.keys()) == set(loaded[species].additional_data.keys())
+
+#Check that the batched solver gives the same analysis weights as the column-by-column calculation, 
+#including for columns with different numbers of observations (which are zero-padded in the batch).
+def test_batched_LETKF_weights():
+	testing_tools.setupPytestSettings('methane')
+	assim = testing_tools.prepTestAssimilator()
+	assim.inflation = 0.03
+	k = len(assim.ensemble_numbers)
+	obscounts = [3,7,4]
+	Ypert_stack = np.zeros((len(obscounts),np.max(obscounts),k))
+	ydiff_stack = np.zeros((len(obscounts),np.max(obscounts)))
+	rinv_stack = np.zeros((len(obscounts),np.max(obscounts)))
+	columns = []
+	for i,p in enumerate(obscounts):
+		Ypert = np.random.randn(p,k)
+		ydiff = np.random.randn(p)
+		R = np.diag(np.random.rand(p)+1)
+		Ypert_stack[i,0:p,:] = Ypert
+		ydiff_stack[i,0:p] = ydiff
+		rinv_stack[i,0:p] = 1/np.diag(R)
+		columns.append((Ypert,ydiff,R))
+	batchW = assim.makeBatchedAnalysisWeights(Ypert_stack,ydiff_stack,rinv_stack)
+	for i,(Ypert,ydiff,R) in enumerate(columns):
+		assim.Ypert_background = Ypert
+		assim.ydiff = ydiff
+		assim.R = R
+		assim.makeC()
+		assim.makePtildeAnalysis()
+		assim.makeWAnalysis()
+		assim.makeWbarAnalysis()
+		assim.adjWAnalysis()
+		assert np.allclose(assim.WAnalysis,batchW[i])
+
 #Check that localized statevector puts emission sf at end of column
 def testStateVecSF():
 	testing_tools.setupPytestSettings('methane')
@@ -34,6 +159,24 @@ def testStateVecSF():
 	assert np.abs(sf_from_statevec-assim.gt[1].getEmisSF('CH4')[19,43])<1e-16 #check the above
 
 
+#Check that restricting the background to the assimilated column gives the same analysis as updating the whole localized patch
+def test_column_only_analysis():
+	testing_tools.setupPytestSettings('methane')
+	assim = Assimilator('20190108_0000',1,1)
+	assim.prepareMeansAndPerts(19,43)
+	assim.makeR(19,43)
+	assim.makeC()
+	assim.makePtildeAndWAnalysis()
+	assim.makeWbarAnalysis()
+	assim.adjWAnalysis()
+	assim.makeAnalysisCombinedEnsemble()
+	patchAnalysis,patchBackground = assim.getAnalysisAndBackgroundColumn(19,43,doBackground=True,doPerts=False)
+	assim.prepareMeansAndPerts(19,43,columnOnly=True) #Reuse analysis weights from above
+	assim.makeAnalysisCombinedEnsemble()
+	columnAnalysis,columnBackground = assim.getAnalysisAndBackgroundColumn(19,43,doBackground=True,doPerts=False)
+	assert np.allclose(patchAnalysis,columnAnalysis) and np.allclose(patchBackground,columnBackground)
+
+
 #UNIT TESTS FOR POST ASSIMILATION CORRECTIONS
 
 #Test that we are correctly scaling emissions to match initial standard deviation, if this is the only active analysis correction
@@ -138,3 +281,76 @@ def test_RTPSinAssimilator():
 	if (len(where_std_diff)!=1) or (where_std_diff[0]!=32) :
 		errors.append('RTPS failed to inflate to background std.')
 	assert not errors, "errors occured:\n{}".format("\n".join(errors))     
+
+#Cost-aware partitioning must assign every column to exactly one core, and balance skewed costs better than an even split.
+def test_cost_aware_partition_covers_and_balances():
+	costs = np.ones(1000)
+	costs[0:50] = 40 #A cluster of expensive, observation-dense columns
+	bins = cp.lptPartition(costs,8)
+	even_bins = cp.evenPartition(len(costs),2,4)
+	errors = []
+	if not np.array_equal(np.sort(np.concatenate(bins)),np.arange(len(costs))):
+		errors.append('LPT partition does not assign each column exactly once.')
+	if not np.array_equal(np.concatenate(even_bins),np.arange(len(costs))):
+		errors.append('Even partition does not reproduce the contiguous split.')
+	lpt_max = np.max([np.sum(costs[b]) for b in bins])
+	even_max = np.max([np.sum(costs[b]) for b in even_bins])
+	if lpt_max>=even_max:
+		errors.append(f'LPT partition max load {lpt_max} is not better than even split max load {even_max}.')
+	assert not errors, "errors occured:\n{}".format("\n".join(errors))
+
+#Observations near 180 degrees should wrap around to the first longitude column of a global grid.
+def test_observation_cells_wrap_longitude():
+	lat = np.arange(-90,91,2.0)
+	lon = np.arange(-180,180,2.5)
+	obslat = np.array([0,0,0,0,0])
+	obslon = np.array([-180,179.5,178.5,-179,181])
+	cells = cp.getObservationCells(lat,lon,obslat,obslon)
+	assert np.array_equal(cells%len(lon),[0,0,len(lon)-1,0,0])
+	assert np.array_equal(cells//len(lon),np.repeat(45,5))
+
+#With dynamic scheduling, every column must be claimed exactly once, and idle cores must pick up columns left by slow ones.
+def test_column_queue_claims_each_column_once(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	queue = ColumnQueue(str(tmp_path),'20190101_0000',chunksize=100,verbose=0)
+	slow = queue.claimChunks(1,1)
+	claimed = [next(slow)] #Core (1,1) takes one chunk, then stalls
+	fast_cells = 0
+	for ens in range(2,25):
+		for latinds,loninds in queue.claimChunks(ens,1):
+			claimed.append((latinds,loninds))
+			fast_cells += len(latinds)
+	claimed.extend(list(slow))
+	cells = np.concatenate([(latinds*1000)+loninds for latinds,loninds in claimed])
+	gridsplit = si.getLatLonPar()
+	expected = np.concatenate([(np.array(gridsplit[e][c]['lat'])*1000)+np.array(gridsplit[e][c]['lon']) for e in gridsplit for c in gridsplit[e]])
+	errors = []
+	if len(cells)!=len(np.unique(cells)):
+		errors.append('Some columns were claimed more than once.')
+	if not np.array_equal(np.sort(cells),np.sort(expected)):
+		errors.append('Claimed columns do not match the columns in latlon_par.json.')
+	if fast_cells != len(expected)-100:
+		errors.append('Other cores did not take over the columns of the stalled core.')
+	assert not errors, "errors occured:\n{}".format("\n".join(errors))
+
+#Columns written to a core's container must read back exactly, and only complete containers are counted.
+def test_column_container_round_trip(tmp_path):
+	scratch = str(tmp_path)
+	writer = cs.ColumnWriter(cs.getColumnContainerPrefix(scratch,1,1,'ens_1_core_1_time_20190108_0000'))
+	saved = {}
+	for latind,lonind in [(3,4),(10,2),(0,143)]:
+		saved[(latind,lonind)] = np.random.rand(50,2)
+		writer.write(latind,lonind,saved[(latind,lonind)])
+	errors = []
+	if cs.countAssimilatedColumns(scratch)!=0:
+		errors.append('Incomplete container was counted.')
+	writer.close()
+	cs.ColumnWriter(cs.getColumnContainerPrefix(scratch,1,2,'ens_1_core_2_time_20190108_0000')).close() #A core that assimilated no columns
+	if cs.countAssimilatedColumns(scratch)!=3:
+		errors.append('Column count does not match columns written.')
+	containers = cs.loadColumnContainers(scratch)
+	for (latind,lonind),col in saved.items():
+		found = [c.getColumn(latind,lonind) for c in containers if c.getColumn(latind,lonind) is not None]
+		if (len(found)!=1) or (not np.array_equal(found[0],col)):
+			errors.append(f'Column {(latind,lonind)} did not read back correctly.')
+	assert not errors, "errors occured:\n{}".format("\n".join(errors))
@@ -3,9 +3,14 @@ import pytest
 import xarray as xr
 import numpy as np
 import json
+import shutil
+import netCDF4
 sys.path.append('../core/')
 from GC_Translator import GC_Translator
 import testing_tools
+import localization_tools as lt
+import settings_interface as si
+from ensemble_cube import EnsembleCube
 
 #These tests ensure that we are subsetting columns correctly in the GC_Translator class.
 
@@ -41,3 +46,131 @@ def test_col_subset_of_full_state_vector_methane():
 	column_from_file = da[:,12,16]
 	assert np.allclose(column_from_statevec,column_from_file,atol=1e-10)
 
+#Column indices for many cells at once (used to scatter all assimilated columns in one assignment) must match the
+#indices built cell by cell from full-grid dummy arrays.
+def test_bulk_column_indices_match_per_cell_methane():
+	testing_tools.setupPytestSettings('methane')
+	gt = GC_Translator('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/','20190101_0000',computeStateVec = True)
+	latinds = np.array([0,12,45,90])
+	loninds = np.array([0,16,100,143])
+	bulk = gt.getColumnIndicesForCells(latinds,loninds)
+	statevec = gt.statevec
+	for i in range(len(latinds)):
+		conc_index,conc_incrementor,emis_index,emis_incrementor = statevec.getIndices(latinds[i],loninds[i],getSurroundings=False)
+		per_cell = np.concatenate([conc_index,emis_index+conc_incrementor]) #One species in concentrations and one in emissions
+		assert np.array_equal(bulk[i],per_cell)
+
+
+#Indices read from precomputed localization tables should match the indices calculated on the fly.
+def test_localization_table_matches_on_the_fly(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	gt = GC_Translator('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/','20190101_0000',computeStateVec = True)
+	lat = gt.getLat()
+	lon = gt.getLon()
+	lt.makeLocalizationTables(lat,lon,float(gt.statevec.species_config['LOCALIZATION_RADIUS_km']),str(tmp_path),verbose=0)
+	table = lt.LocalizationTable(str(tmp_path),len(lat),len(lon))
+	for getSurroundings in [False,True,'intersect']:
+		gt.statevec.localization_table = None
+		on_the_fly = gt.statevec.getIndices(10,10,getSurroundings)
+		gt.statevec.localization_table = table
+		from_table = gt.statevec.getIndices(10,10,getSurroundings)
+		for a,b in zip(on_the_fly,from_table):
+			assert np.array_equal(a,b)
+
+#State vectors gathered from the shared ensemble cube should match the state vectors from each GC_Translator.
+def test_ensemble_cube_matches_translators(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	directories = {1:'data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/',2:'data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0002/'}
+	cube = EnsembleCube(str(tmp_path),'20190101_0000',verbose=0)
+	cube.buildOrAttach(directories,'20190101_0000',str(tmp_path/'KILL_ENS'))
+	gt = GC_Translator(directories[1],'20190101_0000',computeStateVec = True)
+	inds = gt.getLocalizedStateVectorIndices(10,10)
+	from_cube = cube.getStateVectors(inds)
+	for ens in directories:
+		from_translator = GC_Translator(directories[ens],'20190101_0000',computeStateVec = True).getStateVector(10,10)
+		assert np.allclose(from_cube[:,ens-1],from_translator)
+
+#Only the state vector species should be read into memory, but every restart variable should match the file.
+def test_lazy_restart_matches_file_methane():
+	testing_tools.setupPytestSettings('methane')
+	gt = GC_Translator('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/','20190101_0000',computeStateVec = True)
+	assert isinstance(gt.data.restart_ds['SpeciesRst_CH4'].variable._data,np.ndarray)
+	ds = xr.load_dataset('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/GEOSChem.Restart.20190101_0000z.nc4')
+	for variable in ds.data_vars:
+		assert np.array_equal(np.array(gt.data.restart_ds[variable]),np.array(ds[variable]),equal_nan=True)
+
+#Saving should overwrite the modified species in place and leave every other restart variable unchanged.
+def test_in_place_restart_save_methane(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	rundir = f'{tmp_path}/METHANE_TEST_0001/'
+	shutil.copytree('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/',rundir)
+	original = xr.load_dataset(f'{rundir}GEOSChem.Restart.20190101_0000z.nc4')
+	gt = GC_Translator(rundir,'20190101_0000',computeStateVec = True)
+	gt.setSpecies3Dconc('CH4',gt.getSpecies3Dconc('CH4')*1.1)
+	gt.saveRestart()
+	saved = xr.load_dataset(f'{rundir}GEOSChem.Restart.20190101_0000z.nc4')
+	assert np.allclose(saved['SpeciesRst_CH4'],original['SpeciesRst_CH4']*1.1)
+	for variable in original.data_vars:
+		if variable != 'SpeciesRst_CH4':
+			assert np.array_equal(np.array(saved[variable]),np.array(original[variable]),equal_nan=True)
+
+#Restart encoding should keep each species' dtype and put one whole 3D field in each chunk.
+def test_restart_output_encoding_methane():
+	testing_tools.setupPytestSettings('methane')
+	data = si.getSpeciesConfig()
+	data['OUTPUT_ENCODING']['restart'] = {"zlib":"True", "complevel":"1", "shuffle":"True", "chunks":"lev,lat,lon"}
+	ds = xr.open_dataset('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/GEOSChem.Restart.20190101_0000z.nc4')
+	encoding = si.getOutputEncoding(ds,'restart',data)
+	assert encoding['SpeciesRst_CH4']['zlib']
+	assert encoding['SpeciesRst_CH4']['chunksizes'] == (1,)+ds['SpeciesRst_CH4'].shape[1:]
+	assert encoding['SpeciesRst_CH4']['dtype'] == ds['SpeciesRst_CH4'].encoding['dtype']
+
+#Each save should append one time step of scaling factors along an unlimited time dimension, leaving earlier time steps unchanged.
+def test_scaling_factors_appended_methane(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	rundir = f'{tmp_path}/METHANE_TEST_0001/'
+	shutil.copytree('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/',rundir)
+	original = xr.load_dataset(f'{rundir}CH4_SCALEFACTOR.nc')
+	ntime = len(original['time'])
+	for i,value in enumerate([0.5,2.0]):
+		gt = GC_Translator(rundir,'20190101_0000',computeStateVec = True)
+		emis2d = np.full(np.shape(gt.getEmisSF('CH4')),value)
+		if gt.useLognormal:
+			emis2d = np.log(emis2d) #Scaling factors are handled in gaussian space
+		gt.addEmisSF('CH4',emis2d)
+		gt.saveEmissions()
+		with netCDF4.Dataset(f'{rundir}CH4_SCALEFACTOR.nc') as nc:
+			assert nc.dimensions['time'].isunlimited()
+			assert len(nc.dimensions['time']) == ntime+i+1
+			assert np.allclose(nc['Scalar'][-1,:,:],value)
+			assert np.allclose(nc['Scalar'][0:ntime,:,:],np.array(original['Scalar']))
+
+#The shipped scaling factors store time as integer days and are not unlimited. Saving several sub-daily windows should convert time
+#to float hours, keep the earlier history, and getEmisSF should return the scaling factors saved for the latest window.
+def test_scaling_factors_sub_daily_windows_legacy_time_methane(tmp_path):
+	testing_tools.setupPytestSettings('methane')
+	rundir = f'{tmp_path}/METHANE_TEST_0001/'
+	shutil.copytree('data_for_tests/METHANE_TEST/ensemble_runs/METHANE_TEST_0001/',rundir)
+	original = xr.load_dataset(f'{rundir}CH4_SCALEFACTOR.nc')
+	ntime = len(original['time'])
+	timestamps = ['20190101_0000','20190101_0600','20190101_1200','20190101_1800']
+	for i,timestamp in enumerate(timestamps):
+		if timestamp != timestamps[0]:
+			shutil.copy(f'{rundir}GEOSChem.Restart.{timestamps[0]}z.nc4',f'{rundir}GEOSChem.Restart.{timestamp}z.nc4')
+		gt = GC_Translator(rundir,timestamp)
+		emis2d = np.full(np.shape(gt.getEmisSF('CH4')),1.0+i)
+		if gt.useLognormal:
+			emis2d = np.log(emis2d) #Scaling factors are handled in gaussian space
+		gt.addEmisSF('CH4',emis2d)
+		gt.saveEmissions()
+		latest = GC_Translator(rundir,timestamp).getEmisSF('CH4')
+		if gt.useLognormal:
+			latest = np.exp(latest)
+		assert np.allclose(latest,1.0+i)
+	with netCDF4.Dataset(f'{rundir}CH4_SCALEFACTOR.nc') as nc:
+		assert nc.dimensions['time'].isunlimited()
+		assert np.issubdtype(nc['time'].dtype,np.floating)
+	saved = xr.load_dataset(f'{rundir}CH4_SCALEFACTOR.nc')
+	assert np.array_equal(saved['time'].values[0:ntime],original['time'].values)
+	assert np.array_equal(saved['time'].values[ntime:],np.array([np.datetime64(f'2019-01-01T{t[9:11]}:00') for t in timestamps],dtype=saved['time'].dtype))
+	assert np.allclose(saved['Scalar'][0:ntime,:,:],original['Scalar'])
@@ -0,0 +1,60 @@
+import sys
+import pytest
+import numpy as np
+sys.path.append('../core/')
+import distance_tools as dt
+
+#These tests check the vectorized great circle distances and the KD-tree radius queries used for localization.
+
+QUARTER_km = np.pi*dt.EARTH_RADIUS_km/2
+HALF_km = np.pi*dt.EARTH_RADIUS_km
+
+#Independent reference: haversine formula on the same spherical Earth.
+def haversine_km(lat1,lon1,lat2,lon2):
+	lat1,lon1,lat2,lon2 = [np.radians(x) for x in [lat1,lon1,lat2,lon2]]
+	hav = np.sin((lat2-lat1)/2)**2+(np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2)
+	return 2*dt.EARTH_RADIUS_km*np.arcsin(np.sqrt(hav))
+
+#Known distances, including antipodal points and pairs that cross the dateline.
+def test_great_circle_known_distances():
+	pairs = [((0,0,0,0),0),
+		((0,0,0,90),QUARTER_km),
+		((0,0,90,0),QUARTER_km),
+		((0,0,0,180),HALF_km),
+		((90,0,-90,0),HALF_km),
+		((45,30,-45,-150),HALF_km),
+		((0,179,0,-179),2*np.pi*dt.EARTH_RADIUS_km/180),
+		((0,-180,0,180),0),
+		((-30,170,-30,-170),haversine_km(-30,170,-30,-170))]
+	for (lat1,lon1,lat2,lon2),expected in pairs:
+		assert np.isclose(dt.greatCircleDistance_km(lat1,lon1,lat2,lon2),expected,rtol=1e-9,atol=1e-6)
+		assert np.isclose(dt.greatCircleDistance_km(lat2,lon2,lat1,lon1),expected,rtol=1e-9,atol=1e-6)
+
+#One-to-many and many-to-many distances should match the pairwise reference, including across the dateline.
+def test_vectorized_distances_match_pairwise():
+	rng = np.random.default_rng(1)
+	lats1 = rng.uniform(-90,90,20)
+	lons1 = rng.uniform(-180,180,20)
+	lats2 = np.concatenate([rng.uniform(-90,90,30),[0,-lats1[0]]])
+	lons2 = np.concatenate([rng.uniform(-180,180,30),[179.9,lons1[0]+180]])
+	fromPoint = dt.distToPoints_km(lats1[0],lons1[0],lats2,lons2)
+	assert np.allclose(fromPoint,haversine_km(lats1[0],lons1[0],lats2,lons2),rtol=1e-7,atol=1e-6)
+	assert np.isclose(fromPoint[-1],HALF_km) #antipode of the first point
+	matrix = dt.distMatrix_km(lats1,lons1,lats2,lons2)
+	assert np.shape(matrix) == (len(lats1),len(lats2))
+	for i in range(len(lats1)):
+		assert np.allclose(matrix[i,:],haversine_km(lats1[i],lons1[i],lats2,lons2),rtol=1e-7,atol=1e-6)
+
+#Radius queries on the KD-tree should return exactly the points a brute force distance calculation finds.
+def test_spherical_point_index_matches_brute_force():
+	rng = np.random.default_rng(2)
+	lats = np.concatenate([rng.uniform(-90,90,2000),[89.9,-89.9,0,0]])
+	lons = np.concatenate([rng.uniform(-180,180,2000),[0,45,179.9,-179.9]])
+	index = dt.SphericalPointIndex(lats,lons)
+	for latval,lonval,radius in [(0,180,500),(0,-180,1500),(89,10,2000),(-45,20,800),(10,100,HALF_km)]:
+		inds,distances = index.queryRadius(latval,lonval,radius)
+		brute = np.where(dt.distToPoints_km(latval,lonval,lats,lons)<=radius)[0]
+		assert np.array_equal(inds,brute)
+		assert np.allclose(distances,dt.distToPoints_km(latval,lonval,lats[brute],lons[brute]))
+	inds,distances = dt.SphericalPointIndex([],[]).queryRadius(0,0,1000)
+	assert len(inds)==0